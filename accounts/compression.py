@@ -0,0 +1,243 @@
+"""Compression of the dynamic JSON and CSV responses.
+
+WhiteNoise already serves pre-compressed static files; this middleware covers
+what the views produce (/dashboard/state/, /dashboard/stats/, CSV exports).
+The client's Accept-Encoding picks the coding: zstd and brotli when their
+optional packages (``zstandard``, ``Brotli``) are installed, gzip otherwise.
+
+Only COMPRESS_CONTENT_TYPES are touched: HTML pages carry the CSRF token and
+stay uncompressed (BREACH), xlsx is already a zip, and event streams must
+reach the client as soon as each event is written. Streaming responses are
+compressed on the fly, flushed every STREAM_FLUSH_SIZE bytes of input.
+"""
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    # Optional: brotli is offered only when the Brotli package is installed
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    # Optional: zstd is offered only when the zstandard package is installed
+    zstandard = None
+
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+# Input bytes of a streaming response buffered by the compressor before a flush
+STREAM_FLUSH_SIZE = 64 * 1024
+
+ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*')
+
+
+class Gzip:
+    name = 'gzip'
+
+    def __init__(self):
+        # wbits 31: gzip container
+        self.obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.obj.flush()
+
+
+class Brotli:
+    name = 'br'
+
+    def __init__(self):
+        self.obj = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.obj.process(data)
+
+    def flush(self):
+        return self.obj.flush()
+
+    def finish(self):
+        return self.obj.finish()
+
+
+class Zstd:
+    name = 'zstd'
+
+    def __init__(self):
+        self.obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.obj.flush()
+
+
+def available_encoders():
+    """Encoders usable in this process, most preferred first."""
+    encoders = []
+    if zstandard is not None:
+        encoders.append(Zstd)
+    if brotli is not None:
+        encoders.append(Brotli)
+    encoders.append(Gzip)
+    return encoders
+
+
+def choose_encoder(accept_encoding, encoders=None):
+    """The encoder to use for an Accept-Encoding header, or None."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_ENCODING_RE.fullmatch(part)
+        if not match:
+            continue
+        try:
+            weights[match[1].lower()] = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+    best, best_q = None, 0
+    for encoder in encoders or available_encoders():
+        q = weights.get(encoder.name, weights.get('*', 0))
+        # Ties keep the earlier (preferred) encoder
+        if q > best_q:
+            best, best_q = encoder, q
+    return best
+
+
+def compress(encoder, data):
+    obj = encoder()
+    return obj.compress(data) + obj.finish()
+
+
+def compress_chunks(encoder, chunks):
+    obj = encoder()
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = obj.compress(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_SIZE:
+            out += obj.flush()
+            pending = 0
+        if out:
+            yield out
+    yield obj.finish()
+
+
+async def acompress_chunks(encoder, chunks):
+    obj = encoder()
+    pending = 0
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = obj.compress(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_SIZE:
+            out += obj.flush()
+            pending = 0
+        if out:
+            yield out
+    yield obj.finish()
+
+
+class CompressionMiddleware:
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        encoder = self.negotiate(request, response)
+        if encoder is None:
+            return response
+        if response.streaming:
+            return self.stream(response, encoder)
+        return self.replace_content(response, encoder, compress(encoder, response.content))
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        encoder = self.negotiate(request, response)
+        if encoder is None:
+            return response
+        if response.streaming:
+            return self.stream(response, encoder)
+        # Off the event loop; zlib, brotli and zstandard release the GIL
+        body = await sync_to_async(compress, thread_sensitive=False)(encoder, response.content)
+        return self.replace_content(response, encoder, body)
+
+    def negotiate(self, request, response):
+        """The encoder for this response, or None to send it as it is."""
+        if response.status_code == 304:
+            # Revalidating a 200 that was compressed for this client: a 304
+            # must repeat the ETag that 200 carried, i.e. the weakened one
+            patch_vary_headers(response, ('Accept-Encoding',))
+            if choose_encoder(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+                self.weaken_etag(response)
+            return None
+        if not self.compressible(response):
+            return None
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return choose_encoder(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    def stream(self, response, encoder):
+        if response.is_async:
+            response.streaming_content = acompress_chunks(encoder, response.streaming_content)
+        else:
+            response.streaming_content = compress_chunks(encoder, response.streaming_content)
+        # The compressed size is only known once the stream is done
+        del response.headers['Content-Length']
+        return self.mark_encoded(response, encoder)
+
+    def replace_content(self, response, encoder, body):
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response.headers['Content-Length'] = str(len(body))
+        return self.mark_encoded(response, encoder)
+
+    @classmethod
+    def mark_encoded(cls, response, encoder):
+        cls.weaken_etag(response)
+        response.headers['Content-Encoding'] = encoder.name
+        return response
+
+    @staticmethod
+    def weaken_etag(response):
+        # The compressed bytes differ from the representation the ETag names:
+        # weaken it (RFC 9110 8.8.1); If-None-Match compares weakly anyway
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+
+    @staticmethod
+    def compressible(response):
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in settings.COMPRESS_CONTENT_TYPES:
+            return False
+        if response.streaming:
+            return True
+        return len(response.content) >= settings.COMPRESS_MIN_SIZE
@@ -0,0 +1,269 @@
+"""Bulk deletes behind clear-all and lesson/student removal.
+
+None of the models has delete signals, and every write path deletes a row's
+dependents itself, so rows are removed with plain DELETE statements
+(``raw_delete``) instead of going through Django's delete collector, which
+would look for dependents again.
+
+Clear-all deletes the records CHUNK_SIZE at a time, in id order, each chunk
+in its own short transaction, so writers and readers are only ever held up
+for one chunk. A last transaction then deletes whatever was written in the
+meantime, zeroes the summaries, blanks the students and moves the reset
+point; every client reloads after it. Until then a reload can show a partly
+cleared sheet, which the reset replaces. TRUNCATE is not used: it needs an
+exclusive lock that blocks every reader of the table while it waits.
+
+With CLEAR_SNAPSHOTS on, each chunk is also written to a gzipped JSON-lines
+archive under SNAPSHOT_ROOT as it is deleted, so the archive costs one read
+of rows the chunk visits anyway. ``manage.py restore_snapshot`` writes an
+archive back.
+"""
+import gzip
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import summaries
+from .models import Lesson, Student, Record, StudentSummary, ChangeCursor, Tombstone
+from .services import RECORD_FIELDS, clean_student_field, normalize_record, update_students, write_cells
+
+
+CHUNK_SIZE = 5000
+# Snapshots are written while the clear waits on them: favour speed over size
+GZIP_LEVEL = 1
+SNAPSHOT_FORMAT = 1
+
+
+class InvalidSnapshot(Exception):
+    """The file is not a snapshot written by clear_all()."""
+
+
+def raw_delete(queryset):
+    """Delete with one DELETE statement: no signals or cascades, dependents must be gone."""
+    return queryset._raw_delete(queryset.db)
+
+
+def remove_lesson(lesson, version):
+    """Delete a lesson and its records; call inside the write's transaction."""
+    summaries.forget_lesson(lesson)
+    raw_delete(Record.objects.filter(lesson=lesson))
+    raw_delete(Lesson.objects.filter(pk=lesson.pk))
+    # Clients drop the lesson's cells along with its column
+    Tombstone.objects.create(kind=Tombstone.Kinds.LESSON, lesson_id=lesson.id, version=version)
+
+
+def remove_student(student, version):
+    """Delete a student, its records and summary; call inside the write's transaction."""
+    summaries.forget_student(student)
+    raw_delete(Record.objects.filter(student=student))
+    raw_delete(StudentSummary.objects.filter(student=student))
+    raw_delete(Student.objects.filter(pk=student.pk))
+    # Clients drop the student's cells along with the row
+    Tombstone.objects.create(
+        kind=Tombstone.Kinds.STUDENT, student_id=student.id, level=student.level, version=version
+    )
+
+
+class Snapshot:
+    """Gzipped JSON-lines archive of the data a clear-all removes.
+
+    The first line describes the archive; then ``["R", student_id, lesson_id,
+    attendance, homework, extra, test_score]`` per record and ``["S", id,
+    level, name, note]`` per student with a name or note. The file is written
+    under a temporary name and renamed once complete.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(dir=self.root, prefix='.tmp-', suffix='.jsonl.gz')
+        os.close(fd)
+        self.file = gzip.open(self.tmp, 'wt', encoding='utf-8', compresslevel=GZIP_LEVEL)
+        self.write({
+            'snapshot': SNAPSHOT_FORMAT,
+            'taken_at': timezone.now().isoformat(),
+            'lessons': [[pk, title] for pk, title in Lesson.objects.values_list('id', 'title')],
+        })
+
+    def write(self, row):
+        self.file.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+        self.file.write('\n')
+
+    def records(self, rows):
+        for row in rows:
+            self.write(['R', *row])
+
+    def students(self, rows):
+        for row in rows:
+            self.write(['S', *row])
+
+    def finish(self, name):
+        self.file.close()
+        path = self.root / f'{name}-{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz'
+        os.replace(self.tmp, path)
+        return path
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.tmp)
+
+
+def delete_chunk(after, chunk_size, snapshot=None):
+    """Delete the next ``chunk_size`` records with ids above ``after``; return the last id or None."""
+    rows = Record.objects.filter(pk__gt=after).order_by('pk')
+    if snapshot is not None:
+        chunk = list(rows.values_list('pk', 'student_id', 'lesson_id', *RECORD_FIELDS)[:chunk_size])
+        if not chunk:
+            return None
+        snapshot.records(row[1:] for row in chunk)
+        last = chunk[-1][0]
+    else:
+        last = rows.values_list('pk', flat=True)[chunk_size - 1:chunk_size].first()
+        if last is None:
+            # Less than a chunk left: the final transaction takes it
+            return None
+    raw_delete(Record.objects.filter(pk__gt=after, pk__lte=last))
+    return last
+
+
+def clear_all(on_change=None, chunk_size=CHUNK_SIZE, snapshot_root=None):
+    """Delete every record and blank every student name and note.
+
+    Must not run inside a transaction, or the chunks can't commit on their
+    own. ``on_change(version)`` is called inside the final transaction (e.g.
+    the views' notify_change). With ``snapshot_root`` the removed data is
+    archived there (see Snapshot). Returns ``(version, snapshot path or None)``;
+    clearing a sheet that is already blank writes nothing and returns
+    ``(None, None)``.
+    """
+    snapshot = Snapshot(snapshot_root) if snapshot_root else None
+    try:
+        after = 0
+        cleared = False
+        while after is not None:
+            with transaction.atomic():
+                after = delete_chunk(after, chunk_size, snapshot)
+            cleared = cleared or after is not None
+
+        with transaction.atomic():
+            # As services.finish_write: with nothing to clear the change
+            # sequence is given back, so clients don't reload for nothing
+            savepoint = transaction.savepoint()
+            version = ChangeCursor.advance()
+            # The last part chunk, and records written since the chunks passed
+            # them; writers are held off from here on
+            remaining = Record.objects.all()
+            if snapshot is not None:
+                snapshot.records(remaining.values_list('student_id', 'lesson_id', *RECORD_FIELDS))
+            written = raw_delete(remaining)
+            students = Student.objects.exclude(name="", note="")
+            if snapshot is not None:
+                snapshot.students(students.order_by('id').values_list('id', 'level', 'name', 'note'))
+            written += students.update(name="", note="", version=version)
+            # Every client has to reload after a wipe, so per-row tombstones are moot
+            written += raw_delete(Tombstone.objects.all())
+            if not (cleared or written):
+                transaction.savepoint_rollback(savepoint)
+                if snapshot is not None:
+                    snapshot.discard()
+                return None, None
+            summaries.reset()
+            ChangeCursor.objects.filter(pk=1).update(reset_at=version)
+            if on_change:
+                on_change(version)
+            # Inside the transaction: no clear without its archive
+            path = snapshot.finish(f'clear-{version}') if snapshot else None
+    except BaseException:
+        if snapshot is not None and not snapshot.file.closed:
+            # Chunks already committed are only recoverable from here
+            snapshot.finish('clear-incomplete')
+        raise
+    return version, path
+
+
+def read_snapshot(fileobj):
+    """Parse a snapshot (a binary file) written by clear_all().
+
+    Yields ``('R', (student_id, lesson_id), fields)`` per record and ``('S',
+    student_id, {'name': .., 'note': ..})`` per student. Raises
+    InvalidSnapshot for anything clear_all() would not have written.
+    """
+    with gzip.open(fileobj, 'rt', encoding='utf-8') as lines:
+        n = 1
+        try:
+            header = json.loads(next(lines, 'null'))
+            if not isinstance(header, dict) or header.get('snapshot') != SNAPSHOT_FORMAT:
+                raise InvalidSnapshot("not a snapshot file")
+            for n, line in enumerate(lines, start=2):
+                kind, *row = json.loads(line)
+                if kind == 'R':
+                    sid, lid, *values = row
+                    if len(values) != len(RECORD_FIELDS) or not all(isinstance(i, int) for i in (sid, lid)):
+                        raise ValueError("malformed record")
+                    item = ('R', (sid, lid), normalize_record(dict(zip(RECORD_FIELDS, values))))
+                elif kind == 'S':
+                    sid, _, name, note = row
+                    if not isinstance(sid, int):
+                        raise ValueError("malformed student")
+                    item = ('S', sid, {
+                        'name': clean_student_field('name', name), 'note': clean_student_field('note', note),
+                    })
+                else:
+                    raise ValueError(f"unknown row kind {kind!r}")
+                yield item
+        except (TypeError, ValueError) as exc:
+            raise InvalidSnapshot(f"line {n}: {exc}")
+        except (OSError, EOFError) as exc:
+            # Not gzip, or cut short
+            raise InvalidSnapshot(f"not a snapshot file: {exc}")
+
+
+def restore(fileobj, on_change=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Write a clear-all snapshot (a seekable binary file) back; return ``(students, records)`` read.
+
+    The whole file is checked first, so a damaged one raises InvalidSnapshot
+    before anything is written. Records and names are then written over
+    whatever is stored now, ``chunk_size`` rows at a time, each chunk in its
+    own transaction stamped with one change sequence. Rows of students or
+    lessons deleted since are skipped, and a chunk that changes nothing gives
+    its change sequence back. ``on_change(version)`` and ``progress(students,
+    records)`` are called as for imports.import_rows().
+    """
+    for _ in read_snapshot(fileobj):
+        pass
+    fileobj.seek(0)
+
+    students = records = 0
+    cells, names = {}, {}
+
+    def flush():
+        with transaction.atomic():
+            savepoint = transaction.savepoint()
+            version = ChangeCursor.advance()
+            _, _, written = write_cells(cells, version)
+            _, students_written = update_students(names, version)
+            if not (written or students_written):
+                transaction.savepoint_rollback(savepoint)
+            elif on_change:
+                on_change(version)
+        cells.clear()
+        names.clear()
+        if progress:
+            progress(students, records)
+
+    for kind, key, values in read_snapshot(fileobj):
+        if kind == 'R':
+            cells[key] = values
+            records += 1
+        else:
+            names[key] = values
+            students += 1
+        if len(cells) + len(names) >= chunk_size:
+            flush()
+    if cells or names:
+        flush()
+    return students, records
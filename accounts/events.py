@@ -0,0 +1,164 @@
+"""Fan-out of dashboard change events to open event streams.
+
+Write views publish after commit (see ``views.notify_change``); the
+``/dashboard/events/`` stream subscribes to one channel per dashboard level.
+The broker class is chosen with the EVENTS_BROKER setting. ``LocalBroker``
+delivers within the current process only, which is enough for a single ASGI
+server process and for tests; supervisor/gunicorn.py runs one ASGI worker
+while it is configured. ``PostgresBroker`` relays events through PostgreSQL
+LISTEN/NOTIFY, so every server process receives every event.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+# Events buffered per subscriber before it is told to resync instead
+QUEUE_SIZE = 100
+RESYNC = '{"resync": true}'
+
+
+class Subscription:
+    """One open stream. ``get()`` is awaited on the stream's event loop."""
+
+    def __init__(self, broker, channel, loop, queue_size):
+        self.broker = broker
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, message):
+        # Called from any thread (writers run in sync worker threads)
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Event loop already closed
+            self.close()
+
+    def _put(self, message):
+        if self.queue.full():
+            # A slow client has missed too much; it reloads instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RESYNC
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process broker; needs no external service."""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channel):
+        """Register a subscription on the running event loop."""
+        sub = Subscription(self, channel, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscriptions.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscriptions[sub.channel]
+
+    def channels(self):
+        """Channels that currently have at least one subscriber."""
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subs = list(self._subscriptions.get(channel, ()))
+        for sub in subs:
+            sub.offer(message)
+
+
+class PostgresBroker(LocalBroker):
+    """Cross-process broker over PostgreSQL LISTEN/NOTIFY.
+
+    ``publish`` sends a NOTIFY on the Django connection; each process keeps
+    one listening connection, opened on a thread of its own by the first
+    subscription, and hands what it hears to its local streams. Streams of
+    other processes can't be seen from here, so ``channels`` is every level:
+    each write is still only published to the levels it touched.
+    """
+    NOTIFY_CHANNEL = 'dashboard_events'
+    # PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+    MAX_PAYLOAD = 7999
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        super().__init__(queue_size)
+        self._listener = None
+
+    def subscribe(self, channel):
+        sub = super().subscribe(channel)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self.listen, name='events-listener', daemon=True)
+                self._listener.start()
+        return sub
+
+    def channels(self):
+        from .models import Student
+
+        return set(Student.Levels.values)
+
+    def publish(self, channel, message):
+        payload = json.dumps([channel, message], separators=(',', ':'))
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            # Too big to relay: the streams fetch the delta themselves
+            payload = json.dumps([channel, RESYNC], separators=(',', ':'))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.NOTIFY_CHANNEL, payload])
+
+    def listen(self):
+        import psycopg
+
+        params = connection.get_connection_params()
+        while True:
+            try:
+                with psycopg.connect(**params, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {self.NOTIFY_CHANNEL}')
+                    for notify in conn.notifies():
+                        channel, message = json.loads(notify.payload)
+                        super().publish(channel, message)
+            except psycopg.Error:
+                logger.exception("Event listener lost its connection; reconnecting")
+            # Whatever was sent while the connection was down is lost
+            for channel in super().channels():
+                super().publish(channel, RESYNC)
+            time.sleep(self.RECONNECT_SECONDS)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+    return _broker
@@ -0,0 +1,295 @@
+"""Dashboard export writers and background export jobs.
+
+Both formats are produced row by row: students and their records are read
+from server-side cursors in the same (level, id) order and merged, so memory
+use does not grow with the size of the school.
+
+Jobs build the file on a small thread pool and keep it under EXPORT_ROOT,
+named after the change sequence it was built at. Every dashboard write
+advances that sequence, so an existing file for the current value is still
+accurate and repeat exports are served straight from disk. A direct download
+is built into a temporary file on the same pool and then sent from it, so
+its read transaction is over before a slow client starts receiving it.
+"""
+import asyncio
+import csv
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Lesson, Student, Record, ChangeCursor, ExportJob
+
+logger = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 2000
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_HEADERS = ['#', 'Ism Familiya', 'Daraja', 'Qo\'shimcha izoh']
+CSV_HEADERS = ['#', 'Ism Familiya', 'Daraja', 'Izoh']
+CONTENT_TYPES = {ExportJob.Formats.XLSX: XLSX_CONTENT_TYPE, ExportJob.Formats.CSV: 'text/csv'}
+# Unfinished jobs older than this are assumed lost (e.g. the process restarted)
+JOB_TIMEOUT = timedelta(minutes=10)
+# Job rows are kept this long for polling, then pruned
+JOB_TTL = timedelta(days=1)
+# Bytes per read when a file is streamed to an ASGI client
+FILE_BLOCK_SIZE = 64 * 1024
+# hide plain '×' to avoid clutter
+ATTENDANCE_SYMBOLS = {'P': '+', 'E': '−', 'A': ''}
+
+
+def iter_rows(headers):
+    """Yield the header row, then one row per student with data.
+
+    Lessons, students and records are read in one transaction (read-only and
+    REPEATABLE READ on PostgreSQL), so the three reads see the same data
+    while writers keep committing. Inside a caller's transaction, its
+    isolation level applies. The transaction stays open until the rows are
+    consumed, so they go to a file (export_tempfile, build_artifact), never
+    straight to a client's socket.
+    """
+    connection = connections[Record.objects.db]
+    snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with transaction.atomic(using=connection.alias):
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        yield from merge_rows(headers)
+
+
+def merge_rows(headers):
+    meaningful = Record.objects.meaningful()
+    lessons = list(Lesson.objects.filter(
+        Exists(meaningful.filter(lesson=OuterRef('pk')))
+    ).values_list('id', 'title'))
+    column = {lid: i for i, (lid, _) in enumerate(lessons)}
+    yield headers + [title for _, title in lessons]
+
+    students = Student.objects.filter(
+        Exists(meaningful.filter(student=OuterRef('pk')))
+    ).order_by('level', 'id').values_list(
+        'id', 'name', 'level', 'note'
+    ).iterator(chunk_size=CHUNK_SIZE)
+    # Only present/excused records produce a symbol, so only those are read.
+    # Such records are meaningful, so their students and lessons are exported.
+    records = Record.objects.filter(
+        attendance__in=('P', 'E')
+    ).order_by('student__level', 'student_id').values_list(
+        'student__level', 'student_id', 'lesson_id', 'attendance'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+    rec = next(records, None)
+    for i, (sid, name, level, note) in enumerate(students, start=1):
+        cells = [''] * len(lessons)
+        # Both cursors walk students in the same (level, id) order, so each
+        # student's records are the next run in the record stream. Records
+        # sorting before the student, or of lessons without a column, have no
+        # place in the sheet and are passed over.
+        while rec is not None and rec[:2] <= (level, sid):
+            if rec[:2] == (level, sid) and rec[2] in column:
+                cells[column[rec[2]]] = ATTENDANCE_SYMBOLS[rec[3]]
+            rec = next(records, None)
+        yield [i, name, level, note] + cells
+
+
+class Echo:
+    """File-like object whose write() hands the value back (for csv.writer)."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv():
+    writer = csv.writer(Echo())
+    for row in iter_rows(CSV_HEADERS):
+        yield writer.writerow(row)
+
+
+async def aiter_file(fileobj):
+    """Blocks of a file for ASGI responses, read off the event loop."""
+    read = sync_to_async(fileobj.read, thread_sensitive=False)
+    while block := await read(FILE_BLOCK_SIZE):
+        yield block
+
+
+def write_xlsx(fileobj):
+    """Write the export workbook to ``fileobj``; raises ImportError without openpyxl."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Dashboard')
+    for row in iter_rows(XLSX_HEADERS):
+        ws.append(row)
+    wb.save(fileobj)
+
+
+def write_export(fileobj, fmt):
+    """Write the export in ``fmt`` to a binary file."""
+    if fmt == ExportJob.Formats.XLSX:
+        write_xlsx(fileobj)
+    else:
+        for line in iter_csv():
+            fileobj.write(line.encode())
+
+
+def export_tempfile(fmt):
+    """Return a temporary file holding the export, rewound for reading."""
+    tmp = tempfile.TemporaryFile()
+    try:
+        write_export(tmp, fmt)
+    except BaseException:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp
+
+
+async def aexport_tempfile(fmt):
+    """export_tempfile() built on the export pool, leaving the event loop and request threads free."""
+    return await asyncio.wrap_future(executor().submit(pooled_export_tempfile, fmt))
+
+
+def pooled_export_tempfile(fmt):
+    try:
+        return export_tempfile(fmt)
+    finally:
+        # Pool threads are long-lived; don't leave their connections open
+        connections.close_all()
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def artifact_key(version, fmt):
+    return hashlib.sha256(f"{version}:{fmt}".encode()).hexdigest()
+
+
+def artifact_path(key, fmt):
+    return Path(settings.EXPORT_ROOT) / f"{key}.{fmt}"
+
+
+def cached_artifact(fmt):
+    """Return the finished file for the current data, opened for reading, or None.
+
+    prune_artifacts() may delete the file at any time, so it is opened rather
+    than checked for; an open file stays readable once deleted.
+    """
+    path = artifact_path(artifact_key(ChangeCursor.load().value, fmt), fmt)
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def build_artifact(version, fmt):
+    """Write the export for ``version`` unless it already exists; return its path.
+
+    The file is written under a temporary name and renamed into place, so
+    readers never see a partial file and concurrent builds are harmless.
+    """
+    path = artifact_path(artifact_key(version, fmt), fmt)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-', suffix=f'.{fmt}')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_export(f, fmt)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    prune_artifacts(version)
+    return path
+
+
+def prune_artifacts(version):
+    """Delete files built for other versions, if ``version`` is still current."""
+    # An older build finishing late must not remove the newer files
+    if ChangeCursor.load().value != version:
+        return
+    keep = {artifact_path(artifact_key(version, f), f).name for f in ExportJob.Formats.values}
+    for path in Path(settings.EXPORT_ROOT).iterdir():
+        if path.name not in keep and not path.name.startswith('.tmp-'):
+            path.unlink(missing_ok=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    # Created lazily so each gunicorn worker gets its own pool after the fork
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS, thread_name_prefix='export'
+            )
+    return _executor
+
+
+def start_job(fmt, user=None):
+    """Return a job for the current data: finished, in flight, or newly queued.
+
+    Must run inside a transaction; new jobs are handed to the pool on commit.
+    """
+    now = timezone.now()
+    ExportJob.objects.filter(created_at__lt=now - JOB_TTL).delete()
+    version = ChangeCursor.load().value
+    key = artifact_key(version, fmt)
+    if artifact_path(key, fmt).exists():
+        return ExportJob.objects.create(
+            format=fmt, version=version, key=key, created_by=user,
+            status=ExportJob.Statuses.DONE, finished_at=now,
+        )
+    running = ExportJob.objects.filter(
+        key=key,
+        status__in=(ExportJob.Statuses.PENDING, ExportJob.Statuses.RUNNING),
+        created_at__gte=now - JOB_TIMEOUT,
+    ).first()
+    if running:
+        return running
+    job = ExportJob.objects.create(format=fmt, version=version, key=key, created_by=user)
+    transaction.on_commit(lambda: executor().submit(run_job, job.pk))
+    return job
+
+
+def run_job(job_id):
+    """Build the artifact for a job (runs on the export pool)."""
+    try:
+        job = ExportJob.objects.get(pk=job_id)
+        # Build at the newest version so the file is never older than its key
+        version = ChangeCursor.load().value
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.Statuses.RUNNING, version=version,
+            key=artifact_key(version, job.format),
+        )
+        try:
+            build_artifact(version, job.format)
+        except Exception as exc:
+            logger.exception("export job %s failed", job_id)
+            ExportJob.objects.filter(pk=job_id).update(
+                status=ExportJob.Statuses.FAILED, error=str(exc), finished_at=timezone.now()
+            )
+        else:
+            ExportJob.objects.filter(pk=job_id).update(
+                status=ExportJob.Statuses.DONE, finished_at=timezone.now()
+            )
+    finally:
+        # Pool threads are long-lived; don't leave their connections open
+        connections.close_all()
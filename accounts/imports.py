@@ -0,0 +1,289 @@
+"""Bulk import of dashboard sheets in the layout exports.py writes.
+
+The first row names the columns: ``#``, name, level, note, then one column
+per lesson title. Each further row is a student; lesson cells hold the
+export's attendance marks. Rows are streamed from the file (csv, or openpyxl
+in read-only mode) and validated and written CHUNK_SIZE at a time, each chunk
+in its own short transaction stamped with one change sequence, so memory
+stays bounded and other writers are never locked out for long. Rows that
+fail validation are skipped and reported; the rest are imported.
+
+Matching is by content, since the export's ``#`` is a running number:
+lessons by title (missing ones are appended with the first chunk that has
+valid rows), students by level and name (missing ones are created). Rows
+sharing a level and name, including rows without a name, are matched to
+such students in id order, so duplicates each keep their own student and
+importing the same sheet twice doesn't duplicate them. Blank cells leave
+stored data alone.
+"""
+import csv
+import io
+
+from django.db import transaction
+from django.db.models import Max
+
+from .exports import CSV_HEADERS, XLSX_HEADERS
+from .models import Lesson, Student, ChangeCursor
+from .services import clean_student_field, write_cells
+
+
+CHUNK_SIZE = 2000
+# Row errors kept for the report; the count covers all of them
+MAX_ERRORS = 100
+# Leading columns before the lessons: #, name, level, note
+FIXED_COLUMNS = 4
+# Their headers as either export format writes them
+FIXED_HEADERS = (CSV_HEADERS, XLSX_HEADERS)
+TITLE_MAX_LENGTH = Lesson._meta.get_field('title').max_length
+# The export's marks, plus the letters and ASCII look-alikes people type
+MARKS = {'+': 'P', '−': 'E', '-': 'E', '×': 'A', 'x': 'A', 'P': 'P', 'E': 'E', 'A': 'A'}
+
+
+class InvalidSheet(Exception):
+    """The file can't be imported at all (unreadable, or a bad header row)."""
+
+
+def cell_text(value):
+    return '' if value is None else str(value).strip()
+
+
+def read_csv(fileobj):
+    """Yield the rows of a binary CSV file (UTF-8, with or without BOM)."""
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise InvalidSheet(f"not a UTF-8 CSV file: {exc}")
+    finally:
+        # Leave the underlying file to its owner
+        text.detach()
+
+
+def read_xlsx(fileobj):
+    """Yield the rows of the first sheet; raises ImportError without openpyxl."""
+    from openpyxl import load_workbook
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception as exc:
+        raise InvalidSheet(f"not an xlsx file: {exc}")
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+READERS = {'csv': read_csv, 'xlsx': read_xlsx}
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.students_created = 0
+        self.students_updated = 0
+        self.lessons_created = 0
+        self.cells = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'students_created': self.students_created,
+            'students_updated': self.students_updated,
+            'lessons_created': self.lessons_created,
+            'cells': self.cells,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def import_rows(rows, chunk_size=CHUNK_SIZE, on_change=None, progress=None):
+    """Import sheet rows (header first); return an ImportResult.
+
+    ``on_change(version)`` is called inside each write transaction (e.g. the
+    views' notify_change), ``progress(result)`` after each committed chunk.
+    Raises InvalidSheet, before writing anything, for an unusable header.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise InvalidSheet("the file is empty")
+    result = ImportResult()
+    sheet = Sheet(header)
+
+    chunk = []
+    for number, row in enumerate(rows, start=2):
+        values = [cell_text(v) for v in row]
+        if not any(values):
+            continue
+        try:
+            chunk.append((number, *parse_row(values, sheet.lessons)))
+        except ValueError as exc:
+            result.error(number, str(exc))
+        if len(chunk) >= chunk_size:
+            write_chunk(chunk, sheet, result, on_change)
+            chunk = []
+            if progress:
+                progress(result)
+    if chunk:
+        write_chunk(chunk, sheet, result, on_change)
+        if progress:
+            progress(result)
+    return result
+
+
+class Sheet:
+    """What the header row says, and how far the import has got.
+
+    ``lessons`` holds ``[lesson_id, title, date]`` per lesson column; the id
+    is None until the lesson is created with the first chunk written.
+    ``seen`` counts the rows seen so far per ``(level, name)``.
+    """
+
+    def __init__(self, header):
+        fixed = [cell_text(v) for v in header[:FIXED_COLUMNS]]
+        if len(fixed) < FIXED_COLUMNS or fixed not in [list(h) for h in FIXED_HEADERS]:
+            raise InvalidSheet(
+                "expected the columns " + ", ".join(CSV_HEADERS) + " and one per lesson"
+            )
+        titles = [cell_text(v) for v in header[FIXED_COLUMNS:]]
+        while titles and not titles[-1]:
+            titles.pop()
+        for i, title in enumerate(titles, start=FIXED_COLUMNS + 1):
+            if not title:
+                raise InvalidSheet(f"column {i} has no lesson title")
+            if len(title) > TITLE_MAX_LENGTH:
+                raise InvalidSheet(f"column {i}: lesson titles are at most {TITLE_MAX_LENGTH} characters")
+        if len(set(titles)) != len(titles):
+            raise InvalidSheet("lesson titles must be unique")
+
+        existing = {}
+        for lid, title, day in Lesson.objects.values_list('id', 'title', 'date'):
+            # Lesson ordering is (order, id): the first lesson with a title wins
+            existing.setdefault(title, [lid, title, day])
+        self.lessons = [existing.get(t) or [None, t, None] for t in titles]
+        self.seen = {}
+
+    def create_lessons(self, version):
+        """Append the sheet's missing lessons; call inside the write's transaction."""
+        missing = [lesson for lesson in self.lessons if lesson[0] is None]
+        if not missing:
+            return 0
+        last = Lesson.objects.aggregate(m=Max('order'))['m']
+        start = 0 if last is None else last + 1
+        created = Lesson.objects.bulk_create([
+            Lesson(title=title, order=start + i, version=version) for i, (_, title, _) in enumerate(missing)
+        ])
+        for lesson, row in zip(created, missing):
+            row[0] = lesson.id
+        return len(created)
+
+
+def parse_row(values, lessons):
+    """Validate one student row; return ``(name, level, note, marks)``."""
+    values = values + [''] * (FIXED_COLUMNS + len(lessons) - len(values))
+    name = clean_student_field('name', values[1])
+    level = values[2].upper()
+    if level not in Student.Levels.values:
+        raise ValueError(f"unknown level {values[2]!r}")
+    note = clean_student_field('note', values[3])
+    marks = []
+    for (_, title, _), value in zip(lessons, values[FIXED_COLUMNS:]):
+        if value and value not in MARKS and value.upper() not in MARKS:
+            raise ValueError(f"{title}: unknown mark {value!r}")
+        marks.append(MARKS.get(value) or MARKS.get(value.upper()) if value else None)
+    return name, level, note, marks
+
+
+def write_chunk(chunk, sheet, result, on_change):
+    with transaction.atomic():
+        # As services.finish_write: a chunk that writes no row gives its
+        # change sequence back, so the cursor and state ETag stay put
+        savepoint = transaction.savepoint()
+        version = ChangeCursor.advance()
+        created = sheet.create_lessons(version)
+        students = result.students_created + result.students_updated
+        student_ids = match_students(chunk, sheet, version, result)
+        cells = {}
+        for sid, (_, _, _, _, marks) in zip(student_ids, chunk):
+            for (lid, _, _), code in zip(sheet.lessons, marks):
+                if code:
+                    cells[(sid, lid)] = {'attendance': code}
+        # Merged over the stored cells, so homework/notes/scores are kept
+        _, _, written = write_cells(cells, version, partial=True)
+        result.lessons_created += created
+        result.rows += len(chunk)
+        result.cells += len(cells)
+        if not (created or written or result.students_created + result.students_updated > students):
+            transaction.savepoint_rollback(savepoint)
+        elif on_change:
+            on_change(version)
+
+
+def match_students(chunk, sheet, version, result):
+    """Return the student id of each row, creating and updating students as needed."""
+    # A row is the n-th of the sheet with its level and name; it takes the
+    # n-th such student in id order, continuing where the previous chunk
+    # stopped, and students created here come last
+    keys = []
+    for _, name, level, _, _ in chunk:
+        n = sheet.seen.get((level, name), 0)
+        sheet.seen[(level, name)] = n + 1
+        keys.append((level, name, n))
+    found = {}
+    named = {(level, name) for level, name, _ in keys if name}
+    if named:
+        counts = {}
+        for sid, level, name, note in Student.objects.filter(
+            level__in={level for level, _ in named}, name__in={name for _, name in named}
+        ).order_by('id').values_list('id', 'level', 'name', 'note'):
+            n = counts.get((level, name), 0)
+            counts[(level, name)] = n + 1
+            found[(level, name, n)] = (sid, note)
+    # Unnamed students are many; only fetch the slice this chunk's rows take
+    unnamed = {}
+    for level, name, n in keys:
+        if not name:
+            first, last = unnamed.get(level, (n, n))
+            unnamed[level] = (min(first, n), max(last, n))
+    for level, (first, last) in unnamed.items():
+        ids = Student.objects.filter(level=level, name="").order_by('id').values_list('id', 'note')
+        for n, (sid, note) in enumerate(ids[first:last + 1], start=first):
+            found[(level, '', n)] = (sid, note)
+
+    new, notes = {}, {}
+    for key, (_, name, level, note, marks) in zip(keys, chunk):
+        if key in found:
+            sid, current = found[key]
+            if note and note != current:
+                notes[sid] = note
+            continue
+        # First lesson the student has a mark for, so earlier-dated marks still count
+        dates = [day for (_, _, day), code in zip(sheet.lessons, marks) if code and day]
+        new[key] = Student(name=name, level=level, note=note, version=version, joined_at=min(dates, default=None))
+
+    if new:
+        students = list(new.values())
+        joined = [s.joined_at for s in students]
+        Student.objects.bulk_create(students)
+        # auto_now_add stamped today on every new student; put the sheet's dates back
+        redated = []
+        for student, day in zip(students, joined):
+            if day:
+                student.joined_at = day
+                redated.append(student)
+        Student.objects.bulk_update(redated, ['joined_at'])
+        found.update((key, (s.id, s.note)) for key, s in new.items())
+        result.students_created += len(students)
+    if notes:
+        Student.objects.bulk_update(
+            [Student(id=sid, note=note, version=version) for sid, note in notes.items()], ['note', 'version']
+        )
+        result.students_updated += len(notes)
+
+    return [found[key][0] for key in keys]
@@ -0,0 +1,134 @@
+"""Database instrumentation per request.
+
+``record_queries()`` counts the queries run on any database connection while
+it is open, with their total time and the slowest statement (every statement
+if asked to). The middleware records each request this way and reports the
+figures in a ``Server-Timing`` header and in the ``accounts.instrumentation``
+log; the query budget tests in accounts/tests.py use the same context manager.
+
+Streaming responses (the CSV export) are measured up to the point the
+response is returned; rows read while the body streams are not included.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+# Characters of the slowest statement written to the log
+SQL_LOG_LENGTH = 500
+
+# QueryStats of the record_queries() blocks open in this context
+_recording = ContextVar('recording', default=())
+
+
+class QueryStats:
+    """Totals of the queries run while it is recorded (see record_queries).
+
+    With ``keep_statements`` every statement is also kept, in order.
+    """
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = (0.0, '')
+        self.statements = [] if keep_statements else None
+
+    def add(self, sql, elapsed):
+        self.count += 1
+        self.duration += elapsed
+        if self.statements is not None:
+            self.statements.append(sql)
+        if elapsed > self.slowest[0]:
+            self.slowest = (elapsed, sql)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Execute wrapper (see Django's ``connection.execute_wrapper``) feeding the open recordings."""
+    recording = _recording.get()
+    if not recording:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for stats in recording:
+            stats.add(sql, elapsed)
+
+
+def install(connection, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+# Connections are per thread; every one gets the wrapper as it connects
+connection_created.connect(install)
+
+
+@contextmanager
+def record_queries(keep_statements=False):
+    """Collect QueryStats for the queries run inside the block, on any connection.
+
+    Recordings follow the context rather than the thread, so queries an async
+    caller runs through sync_to_async() are counted too.
+    """
+    stats = QueryStats(keep_statements)
+    for conn in connections.all(initialized_only=True):
+        install(conn)
+    token = _recording.set((*_recording.get(), stats))
+    try:
+        yield stats
+    finally:
+        _recording.reset(token)
+
+
+class InstrumentationMiddleware:
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with record_queries() as stats:
+            response = self.get_response(request)
+        return self.report(request, response, stats, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with record_queries() as stats:
+            response = await self.get_response(request)
+        return self.report(request, response, stats, start)
+
+    @staticmethod
+    def report(request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.duration * 1000
+
+        response['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{stats.count} queries", total;dur={total_ms:.1f}'
+        )
+        logger.info(
+            "%s %s %s: %d queries, %.1f ms db, %.1f ms total",
+            request.method, request.path, response.status_code, stats.count, db_ms, total_ms,
+        )
+        slowest_ms, sql = stats.slowest[0] * 1000, stats.slowest[1]
+        if slowest_ms >= settings.SLOW_QUERY_MS:
+            logger.warning(
+                "%s %s: slowest query %.1f ms: %s",
+                request.method, request.path, slowest_ms, sql[:SQL_LOG_LENGTH],
+            )
+        return response
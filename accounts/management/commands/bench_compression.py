@@ -0,0 +1,50 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import compression, exports, payloads
+from accounts.models import Student, ChangeCursor
+from accounts.views import DashboardStateView
+
+
+class Command(BaseCommand):
+    help = (
+        "Compress the current dashboard payloads (state JSON, columnar state, a level page, CSV export) "
+        "with every available encoder and report bytes and time saved. Read-only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per payload and encoder (median is shown).")
+        parser.add_argument('--mbps', type=float, default=2.0, help="Link speed used to estimate transfer time.")
+
+    def handle(self, *args, **options):
+        cursor = ChangeCursor.load().value
+        level = Student.objects.order_by('level').values_list('level', flat=True).first() or Student.Levels.values[0]
+        bodies = {
+            'state (map)': payloads.encode(DashboardStateView.full_data(cursor)),
+            'state (columnar)': payloads.encode(DashboardStateView.full_data(cursor, payloads.records_columns)),
+            f'level page {level}': payloads.encode(
+                DashboardStateView.level_page_data(cursor, level, 0, DashboardStateView.PAGE_SIZE)
+            ),
+            'export csv': b''.join(chunk.encode() for chunk in exports.iter_csv()),
+        }
+        bytes_per_ms = options['mbps'] * 1_000_000 / 8 / 1000
+        encoders = compression.available_encoders()
+        self.stdout.write(f"Encoders: {', '.join(e.name for e in encoders)}; link {options['mbps']} Mbit/s")
+        self.stdout.write(f"{'payload':<22}{'encoding':<10}{'bytes':>12}{'ratio':>8}{'cpu ms':>9}{'saved ms':>10}")
+        for name, body in bodies.items():
+            raw_ms = len(body) / bytes_per_ms
+            self.stdout.write(f"{name:<22}{'identity':<10}{len(body):>12}{1:>8.2f}{0:>9.2f}{0:>10.1f}")
+            for encoder in encoders:
+                timings = []
+                for _ in range(max(options['repeat'], 1)):
+                    start = time.perf_counter()
+                    compressed = compression.compress(encoder, body)
+                    timings.append((time.perf_counter() - start) * 1000)
+                cpu_ms = statistics.median(timings)
+                saved_ms = raw_ms - (len(compressed) / bytes_per_ms + cpu_ms)
+                ratio = len(body) / len(compressed) if compressed else 0
+                self.stdout.write(
+                    f"{'':<22}{encoder.name:<10}{len(compressed):>12}{ratio:>8.2f}{cpu_ms:>9.2f}{saved_ms:>10.1f}"
+                )
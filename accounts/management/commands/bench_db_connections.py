@@ -0,0 +1,132 @@
+import itertools
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from accounts.models import Student, ChangeCursor
+
+
+MODES = ('new', 'persistent', 'pool')
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare request latency (p50/p99) with a new database connection per request, persistent "
+        "connections (CONN_MAX_AGE) and the psycopg pool (DB_POOL), through the full request stack. "
+        "Replays the dashboard's read pattern (delta fetch, stats) against the current data. Needs "
+        "PostgreSQL; the pool mode also needs psycopg-pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Timed requests per mode.")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent clients (each its own thread).")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument(
+            '--pool-size', type=int,
+            help="Pool max_size for the pool mode (default: the number of threads).",
+        )
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError("Connection setup is only worth measuring on PostgreSQL.")
+        level = Student.objects.order_by('level').values_list('level', flat=True).first()
+        if level is None:
+            raise CommandError("No dashboard data; run generate_dataset first.")
+        cursor = ChangeCursor.load().value
+        self.paths = [f'/dashboard/state/?level={level}&since={cursor}', f'/dashboard/stats/?level={level}']
+
+        user = get_user_model().objects.create_user(
+            username='bench-db-connections', role=get_user_model().Roles.TEACHER
+        )
+        settings_dict = connections.settings['default']
+        saved = {key: settings_dict.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        saved_options = dict(settings_dict.get('OPTIONS', {}))
+        self.opened = 0
+        lock = threading.Lock()
+
+        def on_connect(**kwargs):
+            with lock:
+                self.opened += 1
+
+        connection_created.connect(on_connect)
+        try:
+            self.stdout.write(f"{options['requests']} requests per mode, {options['threads']} threads")
+            self.stdout.write(f"{'mode':<12}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'req/s':>9}{'connects':>10}")
+            for mode in options['modes']:
+                self.configure(settings_dict, saved_options, mode, options['pool_size'] or options['threads'])
+                start = self.opened
+                timings, elapsed = self.run(user, options['requests'], options['threads'])
+                connects = self.opened - start
+                self.stdout.write(
+                    f"{mode:<12}{percentile(timings, 50):>9.2f}{percentile(timings, 99):>9.2f}"
+                    f"{statistics.mean(timings):>9.2f}{len(timings) / elapsed:>9.0f}{connects:>10}"
+                )
+                self.reset(settings_dict)
+        finally:
+            connection_created.disconnect(on_connect)
+            self.reset(settings_dict)
+            settings_dict.update(saved)
+            settings_dict['OPTIONS'] = saved_options
+            user.delete()
+
+    @staticmethod
+    def configure(settings_dict, options, mode, pool_size):
+        # Every thread's connection is built from this shared settings dict
+        settings_dict['OPTIONS'] = {k: v for k, v in options.items() if k != 'pool'}
+        settings_dict['CONN_HEALTH_CHECKS'] = True
+        if mode == 'pool':
+            try:
+                import psycopg_pool  # noqa: F401
+            except ImportError:
+                raise CommandError("The pool mode needs psycopg-pool (pip install psycopg-pool).")
+            settings_dict['CONN_MAX_AGE'] = 0
+            settings_dict['OPTIONS']['pool'] = {'min_size': pool_size, 'max_size': pool_size}
+        else:
+            settings_dict['CONN_MAX_AGE'] = 0 if mode == 'new' else None
+
+    @staticmethod
+    def reset(settings_dict):
+        connections['default'].close()
+        if settings_dict.get('OPTIONS', {}).get('pool'):
+            connections['default'].close_pool()
+
+    def run(self, user, requests, threads):
+        timings = []
+        lock = threading.Lock()
+        per_thread = max(requests // threads, 1)
+
+        def client_loop():
+            client = Client()
+            client.force_login(user)
+            # Warm up: open the pool, fill caches
+            for path in self.paths:
+                client.get(path)
+            local = []
+            for path in itertools.islice(itertools.cycle(self.paths), per_thread):
+                start = time.perf_counter()
+                response = client.get(path)
+                local.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f"{path}: {response.status_code}")
+            with lock:
+                timings.extend(local)
+            # Worker threads end here; their connections must not outlive them
+            connections['default'].close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for future in [pool.submit(client_loop) for _ in range(threads)]:
+                future.result()
+        return timings, time.perf_counter() - start
@@ -0,0 +1,184 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+
+from accounts import instrumentation
+from accounts.management.commands.generate_dataset import FILLS, fill
+from accounts.models import Lesson, Student, Record
+
+
+class Rollback(Exception):
+    pass
+
+
+def parse_size(value):
+    """``<students>x<lessons>``, e.g. ``20000x200``."""
+    students, _, lessons = value.partition('x')
+    return int(students), int(lessons or 200)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time state fetches, saves, the export and stats through the full request stack, against the "
+        "current data or, with --sizes, against freshly generated datasets (which REPLACE the data). "
+        "Writes are rolled back. Results can be written as JSON to compare between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=parse_size, default=[],
+            help="Generate and benchmark each <students>x<lessons> dataset, e.g. 2000x50 20000x200.",
+        )
+        parser.add_argument(
+            '--fill', type=fill, default=FILLS['sparse'],
+            help="Record density for generated datasets: dense, sparse or a number (see generate_dataset).",
+        )
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per scenario (median is reported).")
+        parser.add_argument('--cells', type=int, default=200, help="Cells per save request.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        if options['sizes'] and options['interactive']:
+            answer = input("--sizes replaces every lesson, student and record in the database. Continue? [y/N] ")
+            if answer.lower() != 'y':
+                raise CommandError("Cancelled.")
+
+        runs = []
+        for students, lessons in options['sizes'] or [(None, None)]:
+            if students is not None:
+                self.stdout.write(f"Generating {students} students x {lessons} lessons ({options['fill']})...")
+                call_command(
+                    'generate_dataset', f'--students={students}', f'--lessons={lessons}',
+                    f"--fill={options['fill']}", '--replace', stdout=self.stdout,
+                )
+            runs.append(self.benchmark(options))
+
+        result = {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'repeat': options['repeat'],
+            'runs': runs,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def benchmark(self, options):
+        dataset = {
+            'students': Student.objects.count(),
+            'lessons': Lesson.objects.count(),
+            'records': Record.objects.count(),
+        }
+        if not dataset['lessons'] or not dataset['students']:
+            raise CommandError("No dashboard data; run generate_dataset or pass --sizes.")
+        self.stdout.write(
+            f"{dataset['students']} students, {dataset['lessons']} lessons, {dataset['records']} records"
+            f" on {connection.vendor}"
+        )
+        results = {}
+        try:
+            # Everything below, including the benchmark user and its session, is rolled back
+            with transaction.atomic():
+                results = self.run_scenarios(options)
+                raise Rollback
+        except Rollback:
+            pass
+        # Cached snapshots may describe rolled-back writes
+        cache.clear()
+        self.stdout.write(f"{'scenario':<28}{'median ms':>11}{'min ms':>9}{'queries':>9}{'bytes':>12}")
+        for name, r in results.items():
+            self.stdout.write(f"{name:<28}{r['median_ms']:>11.1f}{r['min_ms']:>9.1f}{r['queries']:>9}{r['bytes']:>12}")
+        return {'dataset': dataset, 'results': results}
+
+    def run_scenarios(self, options):
+        user = get_user_model().objects.create_user(
+            username='benchmark-dashboard', role=get_user_model().Roles.ADMIN
+        )
+        client = Client()
+        client.force_login(user)
+        level = Student.objects.order_by('level').values_list('level', flat=True).first()
+        level_students = list(Student.objects.filter(level=level).order_by('id').values_list('id', flat=True)[:50])
+        lesson_ids = list(Lesson.objects.values_list('id', flat=True))
+        cursor = client.get('/dashboard/state/?level=' + level + '&limit=1').json()['cursor']
+        cells = [
+            [sid, lid, 'attendance', 'E'] for sid in level_students for lid in lesson_ids
+        ][:options['cells']]
+        save = {
+            'records': {
+                str(sid): {str(lid): {'attendance': 'P', 'homework': True}} for sid, lid, *_ in cells
+            },
+        }
+
+        def uncached(request):
+            def run():
+                cache.clear()
+                return request()
+            return run
+
+        scenarios = {
+            'state full (uncached)': uncached(lambda: client.get('/dashboard/state/')),
+            'state full (cached)': lambda: client.get('/dashboard/state/'),
+            'state columnar (uncached)': uncached(lambda: client.get('/dashboard/state/?format=columnar')),
+            'state level page': uncached(lambda: client.get(f'/dashboard/state/?level={level}')),
+            'state delta': lambda: client.get(f'/dashboard/state/?level={level}&since={cursor}'),
+            'save cells': lambda: client.patch(
+                '/dashboard/cells/', json.dumps({'changes': cells}), content_type='application/json'
+            ),
+            'save grid': lambda: client.post(
+                '/dashboard/save/', json.dumps(save), content_type='application/json'
+            ),
+            'export csv': lambda: client.get('/dashboard/export/?type=csv'),
+            'stats school': lambda: client.get('/dashboard/stats/'),
+            'stats level': lambda: client.get(f'/dashboard/stats/?level={level}'),
+            'stats student': lambda: client.get(f'/dashboard/stats/?student={level_students[0]}'),
+        }
+        client.get('/dashboard/state/')  # warm up imports and connections
+        return {name: self.measure(run, options['repeat']) for name, run in scenarios.items()}
+
+    @staticmethod
+    def measure(run, repeat):
+        timings, size, stats = [], 0, None
+        for _ in range(max(repeat, 1)):
+            # Writes of one run must not change what the next run sees
+            sid = transaction.savepoint()
+            with instrumentation.record_queries() as stats:
+                start = time.perf_counter()
+                response = run()
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append((time.perf_counter() - start) * 1000)
+            transaction.savepoint_rollback(sid)
+            if response.status_code >= 400:
+                raise CommandError(f"{response.status_code}: {body[:200]!r}")
+            size = len(body)
+        return {
+            'median_ms': round(statistics.median(timings), 2),
+            'min_ms': round(min(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': stats.count,
+            'bytes': size,
+        }
@@ -0,0 +1,127 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts import state_cache, summaries
+from accounts.models import Lesson, Student, Record, ChangeCursor, Tombstone, StudentSummary, LevelSummary
+
+
+CHUNK_SIZE = 5000
+FILLS = {'dense': 1.0, 'sparse': 0.05}
+TERM_START = date(2025, 9, 1)
+
+
+def fill(value):
+    """``dense``, ``sparse`` or the fraction of cells that get a record."""
+    if value in FILLS:
+        return FILLS[value]
+    try:
+        density = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected dense, sparse or a number, got {value!r}")
+    if not 0 <= density <= 1:
+        raise argparse.ArgumentTypeError("density must be between 0 and 1")
+    return density
+
+
+def random_record(rng, student_id, lesson_id, version):
+    roll = rng.random()
+    attendance = 'P' if roll < 0.8 else 'E' if roll < 0.85 else 'A'
+    return Record(
+        student_id=student_id,
+        lesson_id=lesson_id,
+        attendance=attendance,
+        homework=attendance != 'A' and rng.random() < 0.7,
+        extra="bonus" if rng.random() < 0.02 else "",
+        test_score=rng.randint(1, 100) if rng.random() < 0.1 else 0,
+        version=version,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic school: lessons, students spread over the levels and "
+        "records at the given density, written with bulk_create in chunks. Use --replace to drop "
+        "existing dashboard data first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=20000, help="Total students, spread evenly over the levels.")
+        parser.add_argument('--lessons', type=int, default=200)
+        parser.add_argument(
+            '--fill', type=fill, default=FILLS['sparse'],
+            help="Share of cells with a record: dense, sparse (5%%) or a number between 0 and 1.",
+        )
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible datasets.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--replace', action='store_true', help="Delete existing lessons, students and records first.")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if not options['replace'] and (Lesson.objects.exists() or Student.objects.exists()):
+            raise CommandError("The dashboard already has data; pass --replace to delete it first.")
+        rng = random.Random(options['seed'])
+        chunk_size = options['chunk_size']
+        version = ChangeCursor.advance()
+
+        if options['replace']:
+            Record.objects.all().delete()
+            StudentSummary.objects.all().delete()
+            Student.objects.all().delete()
+            Lesson.objects.all().delete()
+            Tombstone.objects.all().delete()
+            LevelSummary.objects.all().delete()
+            # Clients holding older cursors reload in full
+            ChangeCursor.objects.filter(pk=1).update(reset_at=version)
+
+        # Two lessons a week from the start of term
+        lessons = Lesson.objects.bulk_create([
+            Lesson(
+                title=f"{i + 1}-dars", order=i, date=TERM_START + timedelta(days=i // 2 * 7 + i % 2 * 3),
+                version=version,
+            )
+            for i in range(options['lessons'])
+        ], batch_size=chunk_size)
+        lesson_ids = list(Lesson.objects.order_by('order', 'id').values_list('id', flat=True))
+
+        levels = Student.Levels.values
+        students = [
+            Student(name=f"Student {i + 1}", level=levels[i % len(levels)], version=version)
+            for i in range(options['students'])
+        ]
+        Student.objects.bulk_create(students, batch_size=chunk_size)
+        # auto_now_add stamps today: most joined at the start of term, some later
+        late = [lesson.date for lesson in lessons[len(lessons) // 4:]] or [TERM_START]
+        Student.objects.update(joined_at=TERM_START)
+        student_ids = list(Student.objects.order_by('id').values_list('id', flat=True))
+        Student.objects.bulk_update(
+            [Student(id=sid, joined_at=rng.choice(late)) for sid in student_ids[::10]],
+            ['joined_at'], batch_size=chunk_size,
+        )
+
+        density = options['fill']
+        created = 0
+        chunk = []
+        for sid in student_ids:
+            for lid in lesson_ids:
+                if density < 1 and rng.random() >= density:
+                    continue
+                chunk.append(random_record(rng, sid, lid, version))
+                if len(chunk) >= chunk_size:
+                    Record.objects.bulk_create(chunk)
+                    created += len(chunk)
+                    chunk = []
+                    if self.verbosity > 1:
+                        self.stdout.write(f"  {created} records")
+        Record.objects.bulk_create(chunk)
+        created += len(chunk)
+
+        summaries.rebuild()
+        state_cache.record_change(version)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(lesson_ids)} lessons, {len(student_ids)} students and {created} records."
+        ))
@@ -0,0 +1,53 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import exports, imports, state_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a sheet in the dashboard export's layout (#, name, level, note, one column per lesson) "
+        "from a CSV or XLSX file. Lessons are matched by title and students by level and name; missing "
+        "ones are created. Rows that fail validation are skipped and reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or XLSX file.")
+        parser.add_argument(
+            '--format', choices=list(imports.READERS),
+            help="File format; taken from the file extension by default.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=imports.CHUNK_SIZE, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or ('xlsx' if path.suffix.lower() == '.xlsx' else 'csv')
+        if fmt == 'xlsx' and not exports.xlsx_available():
+            raise CommandError("Reading xlsx files needs openpyxl.")
+        start = time.perf_counter()
+
+        def progress(result):
+            self.stdout.write(f"  {result.rows} rows, {result.cells} cells, {result.error_count} errors")
+
+        try:
+            with open(path, 'rb') as f:
+                result = imports.import_rows(
+                    imports.READERS[fmt](f), chunk_size=options['chunk_size'],
+                    on_change=state_cache.record_change, progress=progress,
+                )
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except imports.InvalidSheet as exc:
+            raise CommandError(f"{path}: {exc}")
+
+        for error in result.errors:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.rows} rows ({result.students_created} new students, {result.students_updated} "
+            f"updated, {result.lessons_created} new lessons, {result.cells} cells) "
+            f"in {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,131 @@
+import itertools
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from accounts.models import Student, ChangeCursor
+
+from .bench_db_connections import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent throughput of running servers, e.g. the same deployment started with "
+        "SERVER_MODE=wsgi and SERVER_MODE=asgi (see supervisor/gunicorn.py). Replays the dashboard's "
+        "reads (snapshot page, delta, stats) from many clients at once, optionally while other clients "
+        "keep downloading the xlsx export. The servers must use this project's database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', required=True, metavar='NAME=URL',
+            help="Server to test, e.g. wsgi=http://127.0.0.1:8001; repeat to compare.",
+        )
+        parser.add_argument('--requests', type=int, default=1000, help="Timed requests per target.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Clients sending requests at once.")
+        parser.add_argument(
+            '--exports', type=int, default=0,
+            help="Clients downloading the xlsx export over and over during the run.",
+        )
+        parser.add_argument('--timeout', type=float, default=60.0, help="Seconds before a request fails.")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f"--target must look like NAME=http://host:port, not {target!r}")
+            targets.append((name, url.rstrip('/')))
+        level = Student.objects.order_by('level').values_list('level', flat=True).first()
+        if level is None:
+            raise CommandError("No dashboard data; run generate_dataset first.")
+        cursor = ChangeCursor.load().value
+        self.paths = [
+            f'/dashboard/state/?level={level}&limit=100',
+            f'/dashboard/state/?level={level}&since={cursor}',
+            f'/dashboard/stats/?level={level}',
+        ]
+        self.timeout = options['timeout']
+
+        user = get_user_model().objects.create_user(username='loadtest', role=get_user_model().Roles.TEACHER)
+        client = Client()
+        client.force_login(user)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        try:
+            self.stdout.write(
+                f"{options['requests']} requests per target, {options['concurrency']} at once, "
+                f"{options['exports']} export clients"
+            )
+            self.stdout.write(
+                f"{'target':<12}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'req/s':>9}{'errors':>8}{'exports':>9}"
+            )
+            for name, url in targets:
+                timings, errors, exports, elapsed = self.run(
+                    url, options['requests'], options['concurrency'], options['exports']
+                )
+                if not timings:
+                    raise CommandError(f"{name}: every request failed")
+                self.stdout.write(
+                    f"{name:<12}{percentile(timings, 50):>9.1f}{percentile(timings, 99):>9.1f}"
+                    f"{statistics.mean(timings):>9.1f}{len(timings) / elapsed:>9.0f}{errors:>8}{exports:>9}"
+                )
+        finally:
+            client.logout()
+            user.delete()
+
+    def fetch(self, url):
+        request = urllib.request.Request(url, headers={'Cookie': self.cookie, 'Accept-Encoding': 'identity'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def run(self, base, requests, concurrency, export_clients):
+        # Warm up: the servers' caches and connections
+        for path in self.paths:
+            try:
+                self.fetch(base + path)
+            except (urllib.error.URLError, OSError) as exc:
+                raise CommandError(f"{base}{path}: {exc}")
+
+        done = threading.Event()
+        lock = threading.Lock()
+        exported = [0]
+
+        def export_loop():
+            while not done.is_set():
+                try:
+                    self.fetch(base + '/dashboard/export/')
+                except (urllib.error.URLError, OSError):
+                    continue
+                with lock:
+                    exported[0] += 1
+
+        def timed(path):
+            start = time.perf_counter()
+            try:
+                self.fetch(base + path)
+            except (urllib.error.URLError, OSError):
+                return None
+            return (time.perf_counter() - start) * 1000
+
+        exporters = [threading.Thread(target=export_loop, daemon=True) for _ in range(export_clients)]
+        for thread in exporters:
+            thread.start()
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(timed, itertools.islice(itertools.cycle(self.paths), requests)))
+            elapsed = time.perf_counter() - start
+        finally:
+            done.set()
+            for thread in exporters:
+                thread.join()
+        timings = [ms for ms in results if ms is not None]
+        return timings, len(results) - len(timings), exported[0], elapsed
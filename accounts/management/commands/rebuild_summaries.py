@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts import summaries
+from accounts.models import ChangeCursor
+
+
+class Command(BaseCommand):
+    help = "Recompute the student/level stats summaries from Record, or check them with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Only compare the stored summaries with a fresh count; exit non-zero on mismatch.",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        # Take the change-sequence row lock so no dashboard write interleaves
+        list(ChangeCursor.objects.select_for_update().filter(pk=1))
+        if options['verify']:
+            mismatches = summaries.verify()
+            for kind, key, stored, expected in mismatches:
+                self.stdout.write(f"{kind} {key}: stored {stored}, expected {expected}")
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} summaries out of date; run rebuild_summaries.")
+            self.stdout.write(self.style.SUCCESS("Summaries are up to date."))
+            return
+        summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS("Summaries rebuilt."))
@@ -0,0 +1,40 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import deletions
+from accounts.views import notify_change
+
+
+class Command(BaseCommand):
+    help = (
+        "Write back the records, names and notes archived by a clear-all (CLEAR_SNAPSHOTS, see "
+        "accounts/deletions.py). Archived values replace the stored ones; rows of students or lessons "
+        "deleted since are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Snapshot file (.jsonl.gz) under SNAPSHOT_ROOT.")
+        parser.add_argument('--chunk-size', type=int, default=deletions.CHUNK_SIZE, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        start = time.perf_counter()
+
+        def progress(students, records):
+            self.stdout.write(f"  {records} records, {students} students")
+
+        try:
+            with open(path, 'rb') as f:
+                students, records = deletions.restore(
+                    f, on_change=notify_change, chunk_size=options['chunk_size'], progress=progress,
+                )
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except deletions.InvalidSnapshot as exc:
+            raise CommandError(f"{path}: {exc}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {records} records and {students} student names/notes "
+            f"in {time.perf_counter() - start:.1f}s."
+        ))
@@ -0,0 +1,62 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from accounts import state_cache
+from accounts.models import Lesson, Student, ChangeCursor
+
+
+DEFAULT_LESSONS = 24
+STUDENTS_PER_LEVEL = 30
+
+
+class Command(BaseCommand):
+    help = "Create the default lessons and top every level up to the minimum number of student rows. Safe to re-run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lessons', type=int, default=DEFAULT_LESSONS)
+        parser.add_argument('--students-per-level', type=int, default=STUDENTS_PER_LEVEL)
+
+    def missing(self, options):
+        """Whether the lessons are missing, and how many students each level lacks."""
+        # One grouped COUNT instead of a count per level
+        counts = dict(Student.objects.order_by().values_list('level').annotate(n=Count('id')))
+        lacking = {
+            level: options['students_per_level'] - counts.get(level, 0)
+            for level in Student.Levels.values
+            if counts.get(level, 0) < options['students_per_level']
+        }
+        return not Lesson.objects.exists(), lacking
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        # Re-runs (every container start) find everything seeded: leave the
+        # change cursor, and with it every client's ETag, alone
+        if not any(self.missing(options)):
+            self.stdout.write("Nothing to seed.")
+            return
+        # advance() serializes writers, so a concurrent run can't seed twice
+        version = ChangeCursor.advance()
+        no_lessons, lacking = self.missing(options)
+        created_lessons = 0
+        if no_lessons:
+            today = date.today()
+            Lesson.objects.bulk_create([
+                Lesson(title=f"{i+1}-dars", order=i, date=today, version=version)
+                for i in range(options['lessons'])
+            ])
+            created_lessons = options['lessons']
+
+        new_students = [
+            Student(level=level, name="", version=version)
+            for level, count in lacking.items()
+            for _ in range(count)
+        ]
+        Student.objects.bulk_create(new_students)
+        state_cache.record_change(version)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {created_lessons} lessons and {len(new_students)} students."
+        ))
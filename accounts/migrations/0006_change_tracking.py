@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+def create_cursor(apps, schema_editor):
+    ChangeCursor = apps.get_model('accounts', 'ChangeCursor')
+    ChangeCursor.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_student_level'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+                ('reset_at', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('L', 'Lesson'), ('S', 'Student'), ('R', 'Record')], max_length=1)),
+                ('lesson_id', models.BigIntegerField(blank=True, null=True)),
+                ('student_id', models.BigIntegerField(blank=True, null=True)),
+                ('version', models.BigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(create_cursor, reverse_code=migrations.RunPython.noop),
+    ]
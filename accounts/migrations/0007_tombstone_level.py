@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='level',
+            field=models.CharField(blank=True, default='', max_length=2),
+        ),
+    ]
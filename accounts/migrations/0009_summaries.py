@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_summaries(apps, schema_editor):
+    # Same counting as accounts.summaries.compute(), on the historical models
+    Record = apps.get_model('accounts', 'Record')
+    StudentSummary = apps.get_model('accounts', 'StudentSummary')
+    LevelSummary = apps.get_model('accounts', 'LevelSummary')
+    counters = ('present', 'excused', 'absent', 'homework', 'test_sum')
+    rows = Record.objects.filter(
+        models.Q(lesson__date__isnull=True)
+        | models.Q(student__joined_at__isnull=True)
+        | models.Q(lesson__date__gte=models.F('student__joined_at'))
+    ).values_list('student_id', 'student__level').annotate(
+        present=models.Count('id', filter=models.Q(attendance='P')),
+        excused=models.Count('id', filter=models.Q(attendance='E')),
+        absent=models.Count('id', filter=models.Q(attendance='A')),
+        homework=models.Count('id', filter=models.Q(homework=True)),
+        test_sum=models.Sum('test_score'),
+    ).order_by()
+    students, levels = [], {}
+    for sid, level, *values in rows:
+        students.append(StudentSummary(student_id=sid, **dict(zip(counters, values))))
+        levels[level] = [a + b for a, b in zip(levels.get(level, [0] * 5), values)]
+    StudentSummary.objects.bulk_create(students, batch_size=1000)
+    LevelSummary.objects.bulk_create(
+        [LevelSummary(level=level, **dict(zip(counters, values))) for level, values in levels.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_export_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LevelSummary',
+            fields=[
+                ('present', models.IntegerField(default=0)),
+                ('excused', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('homework', models.IntegerField(default=0)),
+                ('test_sum', models.BigIntegerField(default=0)),
+                ('level', models.CharField(choices=[('A0', 'A0'), ('A1', 'A1'), ('A2', 'A2'), ('B1', 'B1'), ('B2', 'B2'), ('C1', 'C1')], max_length=2, primary_key=True, serialize=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='StudentSummary',
+            fields=[
+                ('present', models.IntegerField(default=0)),
+                ('excused', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('homework', models.IntegerField(default=0)),
+                ('test_sum', models.BigIntegerField(default=0)),
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='accounts.student')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changecursor',
+            name='changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
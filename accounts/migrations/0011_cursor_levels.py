@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_cursor_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changecursor',
+            name='levels',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
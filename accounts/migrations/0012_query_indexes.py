@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_cursor_levels'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['order', 'id'], name='lesson_order_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['lesson', 'student'], name='record_lesson_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(('attendance__in', ('P', 'E')), ('homework', True), models.Q(('extra', ''), _negated=True), ('test_score__gt', 0), _connector='OR'), fields=['student'], name='record_meaningful_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(('attendance__in', ('P', 'E')), ('homework', True), models.Q(('extra', ''), _negated=True), ('test_score__gt', 0), _connector='OR'), fields=['lesson'], name='record_meaningful_lesson_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['level', 'id'], name='student_level_id_idx'),
+        ),
+        # The composite indexes cover what the single-column ones served
+        migrations.AlterField(
+            model_name='lesson',
+            name='order',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='lesson',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='records', to='accounts.lesson'),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='records', to='accounts.student'),
+        ),
+        migrations.AddConstraint(
+            model_name='record',
+            constraint=models.CheckConstraint(condition=models.Q(('attendance__in', ('P', 'E', 'A'))), name='record_attendance_valid'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -24,12 +26,15 @@ class User(AbstractUser):
 
 class Lesson(models.Model):
     title = models.CharField(max_length=50)
-    order = models.PositiveIntegerField(default=0, db_index=True)
+    order = models.PositiveIntegerField(default=0)
     # Optional calendar date for the lesson to support join-date logic
     date = models.DateField(null=True, blank=True)
+    # Global change sequence of the last write to this row (see ChangeCursor)
+    version = models.BigIntegerField(default=0, db_index=True)
 
     class Meta:
         ordering = ["order", "id"]
+        indexes = [models.Index(fields=['order', 'id'], name='lesson_order_id_idx')]
 
     def __str__(self):
         return f"{self.order + 1}: {self.title}"
@@ -49,14 +54,36 @@ class Student(models.Model):
     note = models.CharField(max_length=255, blank=True, default="")
     # Track when a student joined to exclude earlier lessons from stats
     joined_at = models.DateField(auto_now_add=True, null=True)
+    version = models.BigIntegerField(default=0, db_index=True)
+
+    class Meta:
+        # Level pages: WHERE level = %s AND id > %s ORDER BY id
+        indexes = [models.Index(fields=['level', 'id'], name='student_level_id_idx')]
 
     def __str__(self):
         return f"{self.name or '—'} ({self.level})"
 
 
+# Records that count as data in exports: anything but a bare 'A' cell.
+# extra is stored stripped by every write path. The partial indexes on Record
+# use the same condition, so keep the two in step.
+MEANINGFUL = (
+    models.Q(attendance__in=('P', 'E'))
+    | models.Q(homework=True)
+    | ~models.Q(extra='')
+    | models.Q(test_score__gt=0)
+)
+
+
+class RecordQuerySet(models.QuerySet):
+    def meaningful(self):
+        return self.filter(MEANINGFUL)
+
+
 class Record(models.Model):
-    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='records')
-    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='records')
+    # Both keys are indexed by the composite indexes below instead of single-column ones
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='records', db_index=False)
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='records', db_index=False)
     class Attendance(models.TextChoices):
         PRESENT = 'P', '+'
         EXCUSED = 'E', '−'
@@ -66,6 +93,121 @@ class Record(models.Model):
     homework = models.BooleanField(default=False)
     extra = models.CharField(max_length=255, blank=True, default="")
     test_score = models.PositiveIntegerField(default=0)
+    version = models.BigIntegerField(default=0, db_index=True)
+
+    objects = RecordQuerySet.as_manager()
 
     class Meta:
         unique_together = ("student", "lesson")
+        indexes = [
+            # The unique (student, lesson) index serves per-student lookups;
+            # this one per-lesson reads and deletes
+            models.Index(fields=['lesson', 'student'], name='record_lesson_student_idx'),
+            # EXISTS probes of the export for students/lessons with data
+            models.Index(fields=['student'], condition=MEANINGFUL, name='record_meaningful_student_idx'),
+            models.Index(fields=['lesson'], condition=MEANINGFUL, name='record_meaningful_lesson_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(attendance__in=('P', 'E', 'A')), name='record_attendance_valid'
+            ),
+        ]
+
+
+class Summary(models.Model):
+    """Stats counters over the records that count for a student (see summaries.py)."""
+    present = models.IntegerField(default=0)
+    excused = models.IntegerField(default=0)
+    absent = models.IntegerField(default=0)
+    homework = models.IntegerField(default=0)
+    test_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class StudentSummary(Summary):
+    student = models.OneToOneField(
+        Student, primary_key=True, on_delete=models.CASCADE, related_name='summary'
+    )
+
+
+class LevelSummary(Summary):
+    level = models.CharField(max_length=2, primary_key=True, choices=Student.Levels.choices)
+
+
+class ChangeCursor(models.Model):
+    """Singleton row holding the global change sequence used for delta sync.
+
+    Every write path calls ``advance()`` inside its transaction and stamps the
+    rows it touches with the returned value. The UPDATE keeps the row locked
+    until commit, so writers are serialized and a cursor handed to a client
+    can never be overtaken by an earlier change that commits later.
+    """
+    value = models.BigIntegerField(default=0)
+    # Sequence of the last wholesale wipe; clients with older cursors reload fully
+    reset_at = models.BigIntegerField(default=0)
+    # Time of the last advance(); Last-Modified of the state endpoint
+    changed_at = models.DateTimeField(null=True, blank=True)
+    # Level -> sequence of the last change to that level ('*': lessons, i.e. every level)
+    levels = models.JSONField(default=dict, blank=True)
+
+    @classmethod
+    def load(cls):
+        return cls.objects.filter(pk=1).first() or cls(pk=1)
+
+    @classmethod
+    async def aload(cls):
+        return await cls.objects.filter(pk=1).afirst() or cls(pk=1)
+
+    @classmethod
+    def advance(cls):
+        changes = {'value': F('value') + 1, 'changed_at': timezone.now()}
+        if not cls.objects.filter(pk=1).update(**changes):
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(**changes)
+        return cls.objects.values_list('value', flat=True).get(pk=1)
+
+
+class Tombstone(models.Model):
+    """Marker left behind by a delete so delta-sync clients can drop the row."""
+    class Kinds(models.TextChoices):
+        LESSON = 'L', 'Lesson'
+        STUDENT = 'S', 'Student'
+        RECORD = 'R', 'Record'
+
+    kind = models.CharField(max_length=1, choices=Kinds.choices)
+    # Plain ids rather than foreign keys: the referenced rows are gone
+    lesson_id = models.BigIntegerField(null=True, blank=True)
+    student_id = models.BigIntegerField(null=True, blank=True)
+    # Level of the deleted student/record so level-scoped deltas can filter; blank for lessons
+    level = models.CharField(max_length=2, blank=True, default="")
+    version = models.BigIntegerField(db_index=True)
+
+
+class ExportJob(models.Model):
+    """Background export run; the finished file lives under EXPORT_ROOT (see exports.py)."""
+    class Formats(models.TextChoices):
+        XLSX = 'xlsx', 'Excel'
+        CSV = 'csv', 'CSV'
+
+    class Statuses(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    format = models.CharField(max_length=4, choices=Formats.choices, default=Formats.XLSX)
+    status = models.CharField(max_length=8, choices=Statuses.choices, default=Statuses.PENDING)
+    # Change sequence the artifact was built at, and the artifact key derived from it
+    version = models.BigIntegerField(default=0)
+    key = models.CharField(max_length=64, db_index=True)
+    error = models.TextField(blank=True, default="")
+    created_by = models.ForeignKey(
+        'User', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"export {self.pk} ({self.format}, {self.status})"
@@ -5,12 +5,20 @@ from .views import (
     DashboardView,
     DashboardStateView,
     DashboardSaveView,
+    DashboardCellsView,
+    DashboardEventsView,
     DashboardClearView,
     LessonAddView,
     LessonRemoveView,
     StudentAddView,
     StudentRemoveView,
+    DashboardStatsView,
+    DashboardCacheView,
     DashboardExportView,
+    DashboardImportView,
+    ExportJobCreateView,
+    ExportJobView,
+    ExportJobDownloadView,
 )
 
 urlpatterns = [
@@ -20,10 +28,22 @@ urlpatterns = [
     # Dashboard APIs (session-auth protected)
     path("dashboard/state/", DashboardStateView.as_view(), name="dashboard_state"),
     path("dashboard/save/", DashboardSaveView.as_view(), name="dashboard_save"),
+    path("dashboard/cells/", DashboardCellsView.as_view(), name="dashboard_cells"),
+    path("dashboard/events/", DashboardEventsView.as_view(), name="dashboard_events"),
     path("dashboard/clear/", DashboardClearView.as_view(), name="dashboard_clear"),
     path("dashboard/lesson/add/", LessonAddView.as_view(), name="dashboard_lesson_add"),
     path("dashboard/lesson/remove/", LessonRemoveView.as_view(), name="dashboard_lesson_remove"),
     path("dashboard/student/add/", StudentAddView.as_view(), name="dashboard_student_add"),
     path("dashboard/student/remove/", StudentRemoveView.as_view(), name="dashboard_student_remove"),
+    path("dashboard/stats/", DashboardStatsView.as_view(), name="dashboard_stats"),
+    path("dashboard/cache/", DashboardCacheView.as_view(), name="dashboard_cache"),
     path("dashboard/export/", DashboardExportView.as_view(), name="dashboard_export"),
+    path("dashboard/import/", DashboardImportView.as_view(), name="dashboard_import"),
+    path("dashboard/export/jobs/", ExportJobCreateView.as_view(), name="dashboard_export_jobs"),
+    path("dashboard/export/jobs/<int:pk>/", ExportJobView.as_view(), name="dashboard_export_job"),
+    path(
+        "dashboard/export/jobs/<int:pk>/download/",
+        ExportJobDownloadView.as_view(),
+        name="dashboard_export_download",
+    ),
 ]
@@ -0,0 +1,125 @@
+"""Builders and encoder for /dashboard/state/ payloads.
+
+DashboardStateSerializer and DashboardDeltaSerializer document the layout.
+Running thousands of records through nested serializer fields costs several
+Python calls per value, so the view builds the same structure straight from
+``values_list()`` tuples and encodes it in one call. The bytes are identical
+to rendering the serializers with DRF's JSONRenderer (see the parity tests).
+
+Building only reads the database and encoding only uses the CPU, so callers
+can run the two phases separately.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    # Optional: the standard library encoder produces the same bytes, slower
+    orjson = None
+
+from .models import Tombstone
+
+
+LESSON_FIELDS = ('id', 'title', 'order', 'date', 'version')
+STUDENT_FIELDS = ('id', 'name', 'level', 'note', 'joined_at', 'version')
+RECORD_FIELDS = ('attendance', 'homework', 'extra', 'test_score', 'version')
+# JSONRenderer escapes these for JavaScript; ensure_ascii=False leaves them raw
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+def lessons(queryset):
+    return [
+        {'id': pk, 'title': title, 'order': order, 'date': date and date.isoformat(), 'version': version}
+        for pk, title, order, date, version in queryset.values_list(*LESSON_FIELDS)
+    ]
+
+
+def students_by_level(queryset, levels=()):
+    """``{level: [student, ...]}``; ``levels`` are listed first, even if empty."""
+    grouped = {level: [] for level in levels}
+    for pk, name, level, note, joined_at, version in queryset.values_list(*STUDENT_FIELDS):
+        group = grouped.get(level)
+        if group is None:
+            group = grouped[level] = []
+        group.append({
+            'id': pk, 'name': name, 'level': level, 'note': note,
+            'joined_at': joined_at and joined_at.isoformat(), 'version': version,
+        })
+    return grouped
+
+
+def records_map(queryset):
+    """``{student_id: {lesson_id: record}}`` with string keys, as JSON has them."""
+    records = {}
+    last_sid = row = None
+    rows = queryset.order_by('student_id', 'lesson_id').values_list(
+        'student_id', 'lesson_id', *RECORD_FIELDS
+    )
+    for sid, lid, attendance, homework, extra, test_score, version in rows:
+        if sid != last_sid:
+            last_sid = sid
+            row = records.setdefault(str(sid), {})
+        row[str(lid)] = {
+            'attendance': attendance, 'homework': homework, 'extra': extra,
+            'test_score': test_score, 'version': version,
+        }
+    return records
+
+
+def records_columns(queryset):
+    """The records of ``records_map`` as parallel arrays (``?format=columnar``).
+
+    Entry ``i`` of ``student``/``lesson`` indexes the ``students``/``lessons``
+    id lists, ``attendance[i]`` is the record's code character, and ``extra``
+    holds ``[i, text]`` only for records that have one.
+    """
+    student_ids, lesson_index = [], {}
+    student, lesson, attendance, homework, test_score, version, extra = [], [], [], [], [], [], []
+    rows = queryset.order_by('student_id', 'lesson_id').values_list(
+        'student_id', 'lesson_id', *RECORD_FIELDS
+    )
+    for i, (sid, lid, att, hw, ex, score, v) in enumerate(rows):
+        if not student_ids or student_ids[-1] != sid:
+            student_ids.append(sid)
+        student.append(len(student_ids) - 1)
+        j = lesson_index.get(lid)
+        if j is None:
+            j = lesson_index[lid] = len(lesson_index)
+        lesson.append(j)
+        attendance.append(att)
+        homework.append(int(hw))
+        test_score.append(score)
+        version.append(v)
+        if ex:
+            extra.append([i, ex])
+    return {
+        'students': student_ids, 'lessons': list(lesson_index),
+        'student': student, 'lesson': lesson, 'attendance': ''.join(attendance),
+        'homework': homework, 'test_score': test_score, 'version': version, 'extra': extra,
+    }
+
+
+# ?format= values of /dashboard/state/ and the records builder of each
+RECORD_FORMATS = {'map': records_map, 'columnar': records_columns}
+
+
+def deleted(tombstones):
+    result = {'lessons': [], 'students': [], 'records': []}
+    for kind, lesson_id, student_id in tombstones.values_list('kind', 'lesson_id', 'student_id'):
+        if kind == Tombstone.Kinds.LESSON:
+            result['lessons'].append(lesson_id)
+        elif kind == Tombstone.Kinds.STUDENT:
+            result['students'].append(student_id)
+        else:
+            result['records'].append([student_id, lesson_id])
+    return result
+
+
+def encode(data):
+    """Encode a payload exactly as DRF's JSONRenderer would."""
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    return body.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
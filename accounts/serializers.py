@@ -1,6 +1,7 @@
+from django.urls import reverse
 from rest_framework import serializers
 
-from .models import User, Lesson, Student, Record
+from .models import User, Lesson, Student, Record, ExportJob
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -17,26 +18,62 @@ class UserSerializer(serializers.ModelSerializer):
         ]
 
 
+# `version` on lessons, students and records is the change sequence of the row's
+# last write; clients send it back with edits for optimistic concurrency.
 class LessonSerializer(serializers.ModelSerializer):
     class Meta:
         model = Lesson
-        fields = ["id", "title", "order", "date"]
+        fields = ["id", "title", "order", "date", "version"]
 
 
 class RecordSerializer(serializers.ModelSerializer):
     class Meta:
         model = Record
-        fields = ["attendance", "homework", "extra", "test_score"]
+        fields = ["attendance", "homework", "extra", "test_score", "version"]
 
 
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Student
-        fields = ["id", "name", "level", "note", "joined_at"]
+        fields = ["id", "name", "level", "note", "joined_at", "version"]
 
 
+# Layout of /dashboard/state/ responses. DashboardStateView builds and encodes it
+# with accounts/payloads.py for speed; tests check both produce the same bytes.
 class DashboardStateSerializer(serializers.Serializer):
+    # cursor: global change sequence the payload is current up to; pass back as ?since=
+    cursor = serializers.IntegerField()
+    # delta: False when the payload is a full snapshot that replaces client state
+    delta = serializers.BooleanField()
     lessons = LessonSerializer(many=True)
     students = serializers.DictField(child=StudentSerializer(many=True))  # keys: A2/B1/B2
     # records: mapping of student_id -> lesson_id -> record fields
     records = serializers.DictField(child=serializers.DictField(child=RecordSerializer()))
+    # next: ?after= value for the following page of a level-scoped response (null on the last page)
+    next = serializers.IntegerField(required=False)
+
+
+class DeletedSerializer(serializers.Serializer):
+    lessons = serializers.ListField(child=serializers.IntegerField())
+    students = serializers.ListField(child=serializers.IntegerField())
+    # records: [student_id, lesson_id] pairs
+    records = serializers.ListField(child=serializers.ListField(child=serializers.IntegerField()))
+
+
+class DashboardDeltaSerializer(DashboardStateSerializer):
+    # Only rows changed after ?since= are listed above; deletions are reported here
+    deleted = DeletedSerializer()
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    # download: URL of the finished file, null until the job is done
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ["id", "format", "status", "version", "error", "created_at", "finished_at", "download"]
+
+    def get_download(self, obj):
+        if obj.status != ExportJob.Statuses.DONE:
+            return None
+        return reverse("dashboard_export_download", args=[obj.pk])
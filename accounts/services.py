@@ -0,0 +1,347 @@
+"""Batched write paths shared by the dashboard views.
+
+A grid save used to cost a few queries per cell. Everything here validates in
+memory first, diffs against the stored rows, and then writes with a fixed
+number of bulk statements.
+"""
+from datetime import date
+
+from django.db import transaction
+
+from .models import Lesson, Student, Record, ChangeCursor, Tombstone
+from .summaries import SummaryDelta, applicable, redate_lessons
+
+
+RECORD_FIELDS = ('attendance', 'homework', 'extra', 'test_score')
+EXTRA_MAX_LENGTH = Record._meta.get_field('extra').max_length
+NAME_MAX_LENGTH = Student._meta.get_field('name').max_length
+NOTE_MAX_LENGTH = Student._meta.get_field('note').max_length
+# PositiveIntegerField upper bound on every supported backend
+TEST_SCORE_MAX = 2147483647
+
+
+class InvalidPayload(Exception):
+    """Raised before anything is written; ``errors`` lists the offending items."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def normalize_record(data):
+    """Normalize one cell; return its field values, or None when the cell is empty.
+
+    Empty cells are deleted rather than stored as a default 'A' record. A cell
+    with other data but no attendance defaults to 'A' (absent).
+    """
+    att = data.get('attendance', '')
+    if isinstance(att, bool):
+        att = 'P' if att else ''
+    if att not in ('P', 'E', 'A'):
+        att = ''
+    hw = bool(data.get('homework'))
+    extra = (data.get('extra') or '').strip()
+    try:
+        test_score = int(data.get('test_score') or 0)
+    except Exception:
+        test_score = 0
+
+    if not (att or hw or extra or test_score > 0):
+        return None
+    if len(extra) > EXTRA_MAX_LENGTH:
+        raise ValueError(f"extra longer than {EXTRA_MAX_LENGTH} characters")
+    if not 0 <= test_score <= TEST_SCORE_MAX:
+        raise ValueError("test_score out of range")
+    return {'attendance': att or 'A', 'homework': hw, 'extra': extra, 'test_score': test_score}
+
+
+def clean_student_field(field, value):
+    value = value or ''
+    limit = NAME_MAX_LENGTH if field == 'name' else NOTE_MAX_LENGTH
+    if not isinstance(value, str) or len(value) > limit:
+        raise ValueError(f"{field} must be text of at most {limit} characters")
+    return value
+
+
+def clean_cell_field(field, value):
+    """Validate a single changed record field (see apply_changes)."""
+    if field == 'attendance':
+        if value not in ('P', 'E', 'A', '', None):
+            raise ValueError("attendance must be one of P, E, A or empty")
+        return value or ''
+    if field == 'homework':
+        return bool(value)
+    if field == 'extra':
+        value = value or ''
+        if not isinstance(value, str) or len(value.strip()) > EXTRA_MAX_LENGTH:
+            raise ValueError(f"extra must be text of at most {EXTRA_MAX_LENGTH} characters")
+        return value.strip()
+    value = int(value or 0)
+    if not 0 <= value <= TEST_SCORE_MAX:
+        raise ValueError("test_score out of range")
+    return value
+
+
+def parse_lesson_date(value):
+    # allow blank/null date; anything unparsable clears the date
+    try:
+        return date.fromisoformat(value) if value else None
+    except Exception:
+        return None
+
+
+def parse_version(value):
+    # Base version the client last saw; None means "don't check"
+    return None if value is None else int(value)
+
+
+def save_grid(records, students=(), lessons=()):
+    """Apply a full-grid save payload (see DashboardSaveView).
+
+    Items may carry the ``version`` the client last saw; items whose row has
+    moved on since are reported as conflicts and left untouched. Must run
+    inside a transaction. Raises InvalidPayload without writing anything.
+    Returns ``{'version', 'conflicts', 'emptied'}``; version is None when the
+    save changed nothing.
+    """
+    errors = []
+    cells, expected = {}, {}
+    for sid, row in records.items():
+        for lid, data in row.items():
+            try:
+                key = (int(sid), int(lid))
+                cells[key] = normalize_record(dict(data))
+                expected[key] = parse_version(data.get('version'))
+            except (TypeError, ValueError) as exc:
+                errors.append({'student_id': sid, 'lesson_id': lid, 'error': str(exc)})
+
+    student_rows, student_expected = {}, {}
+    for s in students:
+        if 'id' not in s:
+            continue
+        try:
+            sid = int(s['id'])
+            student_rows[sid] = {
+                'name': clean_student_field('name', s.get('name')),
+                'note': clean_student_field('note', s.get('note')),
+            }
+            student_expected[sid] = parse_version(s.get('version'))
+        except (TypeError, ValueError) as exc:
+            errors.append({'student_id': s['id'], 'error': str(exc)})
+
+    lesson_dates, lesson_expected = {}, {}
+    for l in lessons:
+        if 'id' not in l:
+            continue
+        try:
+            lid = int(l['id'])
+            lesson_dates[lid] = parse_lesson_date(l.get('date'))
+            lesson_expected[lid] = parse_version(l.get('version'))
+        except (TypeError, ValueError):
+            errors.append({'lesson_id': l['id'], 'error': "invalid id"})
+
+    if errors:
+        raise InvalidPayload(errors)
+
+    # Every row touched by this save is stamped with one new change sequence.
+    # advance() also serializes writers, so the version checks below cannot race.
+    savepoint = transaction.savepoint()
+    version = ChangeCursor.advance()
+    conflicts, emptied, written = write_cells(cells, version, expected=expected)
+    student_conflicts, students_written = update_students(student_rows, version, expected=student_expected)
+    lesson_conflicts, lessons_written = update_lessons(lesson_dates, version, expected=lesson_expected)
+    return finish_write(
+        savepoint, version, written + students_written + lessons_written,
+        conflicts + student_conflicts + lesson_conflicts, emptied,
+    )
+
+
+def apply_changes(changes):
+    """Apply a list of ``[student_id, lesson_id, field, value, version?]`` edits.
+
+    Record fields (attendance/homework/extra/test_score) address one cell and
+    are merged over the stored record. ``name``/``note`` take a null lesson id,
+    ``date`` a null student id. The optional fifth item is the row version the
+    client based the edit on (0 for a cell with no record); stale edits are
+    returned as conflicts instead of being applied. Every applied row gets the
+    new version, even if its values did not change, so the client can adopt it
+    as the base for its next edit. Must run inside a transaction; raises
+    InvalidPayload without writing anything.
+    Returns ``{'version', 'conflicts', 'emptied'}`` as save_grid() does.
+    """
+    errors = []
+    cells, student_rows, lesson_dates = {}, {}, {}
+    expected, student_expected, lesson_expected = {}, {}, {}
+    for i, change in enumerate(changes):
+        try:
+            sid, lid, field, value, *rest = change
+            base = parse_version(rest[0]) if rest else None
+            if field in RECORD_FIELDS:
+                key = (int(sid), int(lid))
+                cells.setdefault(key, {})[field] = clean_cell_field(field, value)
+                expected[key] = base
+            elif field in ('name', 'note'):
+                student_rows.setdefault(int(sid), {})[field] = clean_student_field(field, value)
+                student_expected[int(sid)] = base
+            elif field == 'date':
+                lesson_dates[int(lid)] = parse_lesson_date(value)
+                lesson_expected[int(lid)] = base
+            else:
+                raise ValueError(f"unknown field {field!r}")
+        except (TypeError, ValueError) as exc:
+            errors.append({'index': i, 'error': str(exc)})
+    if errors:
+        raise InvalidPayload(errors)
+
+    savepoint = transaction.savepoint()
+    version = ChangeCursor.advance()
+    conflicts, emptied, written = write_cells(cells, version, partial=True, expected=expected)
+    student_conflicts, students_written = update_students(student_rows, version, expected=student_expected, force=True)
+    lesson_conflicts, lessons_written = update_lessons(lesson_dates, version, expected=lesson_expected, force=True)
+    return finish_write(
+        savepoint, version, written + students_written + lessons_written,
+        conflicts + student_conflicts + lesson_conflicts, emptied,
+    )
+
+
+def finish_write(savepoint, version, written, conflicts, emptied):
+    """Result of a save; one that wrote no row gives its change sequence back.
+
+    Rolling back to the savepoint taken before advance() keeps the cursor, and
+    with it the state ETag, where it was, and the caller skips notify_change.
+    """
+    if not written:
+        transaction.savepoint_rollback(savepoint)
+        version = None
+    return {'version': version, 'conflicts': conflicts, 'emptied': emptied}
+
+
+def write_cells(cells, version, partial=False, expected=None):
+    """Upsert/delete records for ``{(student_id, lesson_id): fields-or-None}``.
+
+    With ``partial`` the values are dicts of changed fields that are merged over
+    the stored record (or an empty cell) and normalized afterwards, and every
+    applied cell is rewritten; otherwise cells equal to the stored row are
+    skipped so they don't show up in deltas. ``expected`` maps cells to the
+    version the client saw (0 = no record); mismatches become conflicts.
+    Cells pointing at students or lessons that no longer exist are ignored.
+    The student/level summaries are adjusted by the difference.
+    Returns ``(conflicts, emptied, written)``: emptied lists cells left without
+    a record, written counts the records stored or deleted.
+    """
+    expected = expected or {}
+    if not cells:
+        return [], [], 0
+    student_of = {
+        sid: (level, joined_at)
+        for sid, level, joined_at in Student.objects.filter(
+            id__in={sid for sid, _ in cells}
+        ).values_list('id', 'level', 'joined_at')
+    }
+    lesson_date = dict(
+        Lesson.objects.filter(id__in={lid for _, lid in cells}).values_list('id', 'date')
+    )
+    existing = {
+        (sid, lid): (pk, cur_version, values)
+        for pk, sid, lid, cur_version, *values in Record.objects.filter(
+            student_id__in=list(student_of), lesson_id__in=list(lesson_date)
+        ).values_list('id', 'student_id', 'lesson_id', 'version', *RECORD_FIELDS)
+    }
+
+    upserts, deletes, conflicts, emptied = [], [], [], []
+    delta = SummaryDelta()
+    for (sid, lid), fields in cells.items():
+        if sid not in student_of or lid not in lesson_date:
+            continue
+        level, joined_at = student_of[sid]
+        current = existing.get((sid, lid))
+        base = expected.get((sid, lid))
+        if base is not None and base != (current[1] if current else 0):
+            conflicts.append({
+                'student_id': sid, 'lesson_id': lid,
+                'version': current[1] if current else 0,
+                'record': dict(zip(RECORD_FIELDS, current[2])) if current else None,
+            })
+            continue
+        if partial:
+            merged = dict(zip(RECORD_FIELDS, current[2])) if current else {}
+            merged.update(fields)
+            fields = normalize_record(merged)
+        if applicable(lesson_date[lid], joined_at):
+            if current:
+                delta.record(sid, level, dict(zip(RECORD_FIELDS, current[2])), -1)
+            if fields:
+                delta.record(sid, level, fields)
+        if fields is None:
+            emptied.append([sid, lid])
+            if current:
+                deletes.append((current[0], sid, lid))
+        elif partial or current is None or current[2] != [fields[f] for f in RECORD_FIELDS]:
+            upserts.append(Record(student_id=sid, lesson_id=lid, version=version, **fields))
+
+    if upserts:
+        Record.objects.bulk_create(
+            upserts,
+            update_conflicts=True,
+            unique_fields=['student', 'lesson'],
+            update_fields=[*RECORD_FIELDS, 'version'],
+        )
+    if deletes:
+        Record.objects.filter(id__in=[pk for pk, _, _ in deletes]).delete()
+        Tombstone.objects.bulk_create([
+            Tombstone(kind=Tombstone.Kinds.RECORD, student_id=sid, lesson_id=lid,
+                      level=student_of[sid][0], version=version)
+            for _, sid, lid in deletes
+        ])
+    delta.apply()
+    return conflicts, emptied, len(upserts) + len(deletes)
+
+
+def update_students(rows, version, expected=None, force=False):
+    """Write ``{student_id: {'name': .., 'note': ..}}`` (either key optional).
+
+    Only rows that changed are touched unless ``force``. ``expected`` maps ids
+    to the version the client saw; mismatches are returned as conflicts.
+    Returns ``(conflicts, written)``, written being the number of rows updated.
+    """
+    expected = expected or {}
+    if not rows:
+        return [], 0
+    changed, conflicts = [], []
+    for sid, cur_version, name, note in Student.objects.filter(id__in=list(rows)).values_list(
+        'id', 'version', 'name', 'note'
+    ):
+        if expected.get(sid) not in (None, cur_version):
+            conflicts.append({'student_id': sid, 'version': cur_version, 'name': name, 'note': note})
+            continue
+        new = {'name': name, 'note': note, **rows[sid]}
+        if force or (new['name'], new['note']) != (name, note):
+            changed.append(Student(id=sid, version=version, **new))
+    Student.objects.bulk_update(changed, ['name', 'note', 'version'])
+    return conflicts, len(changed)
+
+
+def update_lessons(dates, version, expected=None, force=False):
+    """Write ``{lesson_id: date}``; same change/conflict rules as update_students.
+
+    A new date can change which records count towards the summaries, so those
+    lessons' records are recounted. Returns ``(conflicts, written)``.
+    """
+    expected = expected or {}
+    if not dates:
+        return [], 0
+    changed, conflicts, old_dates = [], [], {}
+    for lid, cur_version, current in Lesson.objects.filter(id__in=list(dates)).values_list(
+        'id', 'version', 'date'
+    ):
+        if expected.get(lid) not in (None, cur_version):
+            conflicts.append({'lesson_id': lid, 'version': cur_version, 'date': current})
+            continue
+        if force or current != dates[lid]:
+            changed.append(Lesson(id=lid, date=dates[lid], version=version))
+        if current != dates[lid]:
+            old_dates[lid] = current
+    Lesson.objects.bulk_update(changed, ['date', 'version'])
+    if old_dates:
+        redate_lessons(old_dates, {lid: dates[lid] for lid in old_dates})
+    return conflicts, len(changed)
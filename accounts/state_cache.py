@@ -0,0 +1,107 @@
+"""Cache of encoded /dashboard/state/ snapshots.
+
+Full snapshots and level pages are stored as rendered JSON bytes in Django's
+cache (LocMem per worker by default, or a shared backend via CACHE_URL).
+Every write records which levels it touched on the ChangeCursor row, in the
+same transaction, so an entry is keyed by the version of the data it covers:
+a write to B1 leaves the cached A0 pages valid. Lesson changes affect every
+level and are recorded under ``*``.
+
+A cached body may be older than the current cursor, so the body is stored
+without its leading ``"cursor"`` value and the current one is spliced in on
+the way out; nothing the entry covers has changed since. Entries are read and
+written from the async state view, through the cache's coroutine API.
+"""
+from django.core.cache import cache
+
+from .models import Lesson, Student, Record, ChangeCursor, Tombstone
+
+
+ALL_LEVELS = '*'
+KEY_PREFIX = 'dashboard:state'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+def touched_levels(version):
+    """Levels whose rows the write stamped ``version`` changed ('*' for lessons)."""
+    levels = set(Student.objects.filter(version=version).values_list('level', flat=True).distinct())
+    levels.update(
+        Record.objects.filter(version=version).values_list('student__level', flat=True).distinct()
+    )
+    for kind, level in Tombstone.objects.filter(version=version).values_list('kind', 'level').distinct():
+        levels.add(ALL_LEVELS if kind == Tombstone.Kinds.LESSON else level)
+    if Lesson.objects.filter(version=version).exists():
+        levels.add(ALL_LEVELS)
+    return levels
+
+
+def record_change(version):
+    """Invalidate entries covering what the write stamped ``version`` touched.
+
+    Must run inside the write's transaction, after ChangeCursor.advance().
+    Returns the levels touched, ``'*'`` standing for all of them (lessons or
+    a wipe).
+    """
+    levels = touched_levels(version)
+    state = ChangeCursor.objects.get(pk=1)
+    if state.reset_at == version:
+        levels.add(ALL_LEVELS)
+    if levels:
+        state.levels.update(dict.fromkeys(levels, version))
+        state.save(update_fields=['levels'])
+    return levels
+
+
+def data_version(state, level=None):
+    """Version of the last change visible in a level's pages (or anywhere)."""
+    if level is None:
+        return state.value
+    return max(state.levels.get(level, 0), state.levels.get(ALL_LEVELS, 0), state.reset_at)
+
+
+def make_key(revision, state, level=None, after=None, limit=None, fmt='map'):
+    variant = 'all' if level is None else f'{level}:{after}:{limit}'
+    return f'{KEY_PREFIX}:{revision}:{fmt}:{variant}:{data_version(state, level)}'
+
+
+def split_cursor(body, cursor):
+    """Drop the leading ``{"cursor":<n>`` from a rendered state body."""
+    head = b'{"cursor":%d' % cursor
+    if not body.startswith(head):
+        raise ValueError("state body must start with its cursor")
+    return body[len(head):]
+
+
+def join_cursor(rest, cursor):
+    return b'{"cursor":%d' % cursor + rest
+
+
+async def aload(key):
+    rest = await cache.aget(key)
+    await acount(HITS_KEY if rest is not None else MISSES_KEY)
+    return rest
+
+
+async def astore(key, rest, timeout):
+    await cache.aset(key, rest, timeout)
+
+
+async def acount(key):
+    await cache.aadd(key, 0, None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        # evicted between aadd() and aincr()
+        await cache.aset(key, 1, None)
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 3) if total else None}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,72 @@
+"""Attendance/homework/test counters for the "Statistika" modal.
+
+A lesson counts for a student when either has no date or the lesson is on or
+after the day the student joined. Record counters are read from the summary
+tables kept up to date by the write paths (see summaries.py), so a read does
+not scan Record at all. The number of applicable lessons
+only depends on lesson dates, so it is derived from the (short) sorted list
+of lesson dates instead of joining students to lessons.
+
+The functions are coroutines for the async stats view and use Django's async
+ORM.
+"""
+from bisect import bisect_left
+
+from django.db.models import Count
+
+from . import summaries
+from .models import Lesson, Student, StudentSummary
+
+
+class LessonTotals:
+    """Number of lessons applicable to a student who joined on a given date."""
+
+    def __init__(self, dates):
+        self.dated = sorted(d for d in dates if d is not None)
+        self.count = len(dates)
+
+    @classmethod
+    async def aload(cls):
+        return cls([d async for d in Lesson.objects.values_list('date', flat=True)])
+
+    def __call__(self, joined_at):
+        if joined_at is None:
+            return self.count
+        return self.count - bisect_left(self.dated, joined_at)
+
+
+def percent(part, total):
+    """Whole percentage with halves rounded up, as the dashboard's Math.round does.
+
+    round() would send halves to the even neighbour (12.5 -> 12).
+    """
+    return (part * 200 + total) // (total * 2) if total else 0
+
+
+def with_rates(stats):
+    stats['attendance_pct'] = percent(stats['present'], stats['total'])
+    stats['homework_pct'] = percent(stats['homework'], stats['total'])
+    return stats
+
+
+async def astudent_stats(student):
+    summary = await StudentSummary.objects.filter(student=student).values(*summaries.COUNTERS).afirst()
+    stats = summary or dict.fromkeys(summaries.COUNTERS, 0)
+    stats['total'] = (await LessonTotals.aload())(student.joined_at)
+    return with_rates(stats)
+
+
+async def agroup_stats(level=None):
+    """Totals over one level, or over the whole school when ``level`` is None."""
+    stats = await summaries.alevel_totals(level)
+    students = Student.objects.all()
+    if level:
+        students = students.filter(level=level)
+    totals = await LessonTotals.aload()
+    # Students sharing a join date share their lesson count
+    groups = students.values_list('joined_at').annotate(n=Count('id')).order_by()
+    stats['total'] = stats['students'] = 0
+    async for joined_at, n in groups:
+        stats['total'] += n * totals(joined_at)
+        stats['students'] += n
+    return with_rates(stats)
@@ -0,0 +1,182 @@
+"""Denormalized stats counters per student and per level.
+
+StudentSummary/LevelSummary hold the same counters stats.py would aggregate
+from Record (present/excused/absent/homework/test_sum over the records that
+count for the student). The dashboard write paths collect the change of each
+touched record in a SummaryDelta and apply it in a couple of bulk queries;
+writers are serialized by ChangeCursor.advance(), so the read-modify-write
+cannot race. ``manage.py rebuild_summaries`` recomputes everything.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Student, Record, StudentSummary, LevelSummary
+
+
+COUNTERS = ('present', 'excused', 'absent', 'homework', 'test_sum')
+ATTENDANCE_COUNTER = {'P': 0, 'E': 1, 'A': 2}
+
+# A record counts unless its lesson is dated before the student joined
+APPLICABLE = (
+    Q(lesson__date__isnull=True)
+    | Q(student__joined_at__isnull=True)
+    | Q(lesson__date__gte=F('student__joined_at'))
+)
+
+
+def applicable(lesson_date, joined_at):
+    """APPLICABLE for one record, evaluated in Python."""
+    return lesson_date is None or joined_at is None or lesson_date >= joined_at
+
+
+def counters(attendance, homework, test_score):
+    values = [0, 0, 0, int(bool(homework)), test_score or 0]
+    if attendance in ATTENDANCE_COUNTER:
+        values[ATTENDANCE_COUNTER[attendance]] = 1
+    return values
+
+
+class SummaryDelta:
+    """Accumulates counter changes per student and level; ``apply()`` writes them."""
+
+    def __init__(self):
+        self.students = defaultdict(lambda: [0] * len(COUNTERS))
+        self.levels = defaultdict(lambda: [0] * len(COUNTERS))
+
+    def add(self, student_id, level, values, sign=1):
+        for totals in (self.students[student_id], self.levels[level]):
+            for i, v in enumerate(values):
+                totals[i] += sign * v
+
+    def record(self, student_id, level, fields, sign=1):
+        """Count (or with ``sign=-1`` uncount) one record given its field dict."""
+        self.add(student_id, level, counters(
+            fields['attendance'], fields['homework'], fields['test_score']
+        ), sign)
+
+    def apply(self):
+        # Missing rows count as zero: every creation path starts a student with no records
+        apply_totals(StudentSummary, 'student_id', self.students)
+        apply_totals(LevelSummary, 'level', self.levels)
+
+
+def apply_totals(model, key, deltas):
+    deltas = {k: d for k, d in deltas.items() if any(d)}
+    if not deltas:
+        return
+    rows = {getattr(r, key): r for r in model.objects.filter(**{f'{key}__in': list(deltas)})}
+    changed, created = [], []
+    for k, delta in deltas.items():
+        row = rows.get(k)
+        if row is None:
+            row = model(**{key: k})
+            created.append(row)
+        else:
+            changed.append(row)
+        for name, d in zip(COUNTERS, delta):
+            setattr(row, name, getattr(row, name) + d)
+    model.objects.bulk_update(changed, COUNTERS)
+    model.objects.bulk_create(created)
+
+
+def reset():
+    """All records were deleted: zero every counter."""
+    zeros = dict.fromkeys(COUNTERS, 0)
+    # Only rows with something to zero, so the clear's transaction stays short
+    StudentSummary.objects.exclude(**zeros).update(**zeros)
+    LevelSummary.objects.exclude(**zeros).update(**zeros)
+
+
+def forget_student(student):
+    """Take a student that is about to be deleted out of its level's totals."""
+    counts = StudentSummary.objects.filter(student_id=student.id).values_list(*COUNTERS).first()
+    if counts:
+        apply_totals(LevelSummary, 'level', {student.level: [-v for v in counts]})
+
+
+def lesson_records(lesson_ids):
+    """Yield ``(student_id, level, joined_at, lesson_id, fields)`` for the lessons' records."""
+    rows = Record.objects.filter(lesson_id__in=lesson_ids).values_list(
+        'student_id', 'student__level', 'student__joined_at', 'lesson_id',
+        'attendance', 'homework', 'test_score',
+    )
+    for sid, level, joined_at, lid, att, hw, score in rows:
+        yield sid, level, joined_at, lid, {'attendance': att, 'homework': hw, 'test_score': score}
+
+
+def forget_lesson(lesson):
+    """Uncount the records of a lesson that is about to be deleted."""
+    delta = SummaryDelta()
+    for sid, level, joined_at, _, fields in lesson_records([lesson.id]):
+        if applicable(lesson.date, joined_at):
+            delta.record(sid, level, fields, -1)
+    delta.apply()
+
+
+def redate_lessons(old_dates, new_dates):
+    """Recount records of lessons whose date changed (``{lesson_id: date}`` each)."""
+    delta = SummaryDelta()
+    for sid, level, joined_at, lid, fields in lesson_records(list(new_dates)):
+        was, now = applicable(old_dates[lid], joined_at), applicable(new_dates[lid], joined_at)
+        if was != now:
+            delta.record(sid, level, fields, 1 if now else -1)
+    delta.apply()
+
+
+def compute():
+    """Return ``({student_id: counters}, {level: counters})`` aggregated from Record."""
+    students = {sid: [0] * len(COUNTERS) for sid in Student.objects.values_list('id', flat=True)}
+    levels = {level: [0] * len(COUNTERS) for level in Student.Levels.values}
+    rows = Record.objects.filter(APPLICABLE).values_list('student_id', 'student__level').annotate(
+        present=Count('id', filter=Q(attendance='P')),
+        excused=Count('id', filter=Q(attendance='E')),
+        absent=Count('id', filter=Q(attendance='A')),
+        homework=Count('id', filter=Q(homework=True)),
+        test_sum=Coalesce(Sum('test_score'), 0),
+    ).order_by()
+    for sid, level, *values in rows:
+        students[sid] = values
+        levels[level] = [a + b for a, b in zip(levels[level], values)]
+    return students, levels
+
+
+def rebuild():
+    students, levels = compute()
+    StudentSummary.objects.all().delete()
+    StudentSummary.objects.bulk_create(
+        [StudentSummary(student_id=sid, **dict(zip(COUNTERS, c))) for sid, c in students.items()],
+        batch_size=1000,
+    )
+    LevelSummary.objects.all().delete()
+    LevelSummary.objects.bulk_create(
+        [LevelSummary(level=level, **dict(zip(COUNTERS, c))) for level, c in levels.items()]
+    )
+
+
+def verify():
+    """Return a list of ``(kind, key, stored, expected)`` mismatches."""
+    students, levels = compute()
+    mismatches = []
+    stored = {
+        row[0]: list(row[1:])
+        for row in StudentSummary.objects.values_list('student_id', *COUNTERS)
+    }
+    for sid, expected in students.items():
+        if stored.get(sid, [0] * len(COUNTERS)) != expected:
+            mismatches.append(('student', sid, stored.get(sid), expected))
+    stored = {row[0]: list(row[1:]) for row in LevelSummary.objects.values_list('level', *COUNTERS)}
+    for level, expected in levels.items():
+        if stored.get(level, [0] * len(COUNTERS)) != expected:
+            mismatches.append(('level', level, stored.get(level), expected))
+    return mismatches
+
+
+async def alevel_totals(level=None):
+    """Counters of one level, or of the whole school when ``level`` is None."""
+    rows = LevelSummary.objects.all()
+    if level:
+        rows = rows.filter(level=level)
+    totals = await rows.aaggregate(**{c: Sum(c) for c in COUNTERS})
+    return {c: totals[c] or 0 for c in COUNTERS}
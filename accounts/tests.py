@@ -1,3 +1,1163 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import compression, deletions, events, exports, imports, instrumentation, payloads, state_cache, summaries
+from .models import User, Lesson, Student, Record, ChangeCursor, Tombstone
+from .serializers import (
+    DashboardStateSerializer,
+    DashboardDeltaSerializer,
+    LessonSerializer,
+    StudentSerializer,
+)
+from .stats import percent
+from .views import DashboardStateView
+
+
+class PayloadParityTests(TestCase):
+    """The fast state payloads must match the DRF serializers byte for byte."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lessons = [
+            Lesson.objects.create(title="1-dars", order=0, date=date(2026, 9, 1), version=1),
+            Lesson.objects.create(title="2-dars", order=1, date=None, version=2),
+            Lesson.objects.create(title="Ўзбек \"тест\"", order=2, version=3),
+        ]
+        names = ["Ali", "Ирина 😀", "tab\there", "line sep ", "ctl\x01\x1f", "", "Zoe"]
+        cls.students = [
+            Student.objects.create(
+                name=name, level=level, note="n\\ote" if i % 2 else "",
+                version=i + 1,
+            )
+            for i, (name, level) in enumerate(zip(names, ["A0", "B1", "B1", "C1", "A0", "B1", "B1"]))
+        ]
+        Student.objects.filter(pk=cls.students[0].pk).update(joined_at=None)
+        for i, s in enumerate(cls.students):
+            for j, l in enumerate(cls.lessons):
+                if (i + j) % 3:
+                    Record.objects.create(
+                        student=s, lesson=l, attendance="PEA"[(i + j) % 3], homework=bool(j % 2),
+                        extra="ok   ✓" if j == 1 else "", test_score=i * j, version=i + j + 1,
+                    )
+        Tombstone.objects.create(kind=Tombstone.Kinds.LESSON, lesson_id=99, version=5)
+        Tombstone.objects.create(kind=Tombstone.Kinds.STUDENT, student_id=98, level="B1", version=6)
+        Tombstone.objects.create(kind=Tombstone.Kinds.RECORD, student_id=97, lesson_id=96, level="A0", version=7)
+
+    def reference_records(self, recs):
+        records = {}
+        for r in recs.order_by('student_id', 'lesson_id'):
+            records.setdefault(str(r.student_id), {})[str(r.lesson_id)] = {
+                'attendance': r.attendance, 'homework': r.homework, 'extra': r.extra,
+                'test_score': r.test_score, 'version': r.version,
+            }
+        return records
+
+    def reference_students(self, students, levels=()):
+        grouped = {level: [] for level in levels}
+        for s in students:
+            grouped.setdefault(s.level, []).append(s)
+        return {key: StudentSerializer(grouped[key], many=True).data for key in grouped}
+
+    def assertSameBytes(self, fast, serializer):
+        expected = JSONRenderer().render(serializer.data)
+        self.assertEqual(payloads.encode(fast), expected)
+        with mock.patch.object(payloads, 'orjson', None):
+            self.assertEqual(payloads.encode(fast), expected)
+
+    def test_full_snapshot(self):
+        reference = DashboardStateSerializer({
+            'cursor': 42,
+            'delta': False,
+            'lessons': LessonSerializer(Lesson.objects.all(), many=True).data,
+            'students': self.reference_students(Student.objects.order_by('id'), Student.Levels.values),
+            'records': self.reference_records(Record.objects.all()),
+        })
+        self.assertSameBytes(DashboardStateView.full_data(42), reference)
+
+    def test_level_page(self):
+        b1 = list(Student.objects.filter(level="B1").order_by('id'))
+        for limit, after in ((2, 0), (2, b1[1].id), (500, 0)):
+            page = [s for s in b1 if s.id > after][:limit]
+            has_more = len([s for s in b1 if s.id > after]) > limit
+            recs = Record.objects.filter(student__level="B1", student_id__gt=after)
+            if has_more:
+                recs = recs.filter(student_id__lte=page[-1].id)
+            reference = DashboardStateSerializer({
+                'cursor': 7,
+                'delta': False,
+                'lessons': LessonSerializer(Lesson.objects.all(), many=True).data,
+                'students': {"B1": StudentSerializer(page, many=True).data},
+                'records': self.reference_records(recs),
+                'next': page[-1].id if has_more else None,
+            })
+            self.assertSameBytes(DashboardStateView.level_page_data(7, "B1", after, limit), reference)
+
+    def test_delta(self):
+        for level in (None, "B1"):
+            students = Student.objects.filter(version__gt=2).order_by('id')
+            recs = Record.objects.filter(version__gt=2)
+            if level:
+                students = students.filter(level=level)
+                recs = recs.filter(student__level=level)
+            tombstones = Tombstone.objects.filter(version__gt=2).order_by('version', 'id')
+            if level:
+                tombstones = tombstones.exclude(level="A0")
+            deleted = {'lessons': [], 'students': [], 'records': []}
+            for t in tombstones:
+                if t.kind == Tombstone.Kinds.LESSON:
+                    deleted['lessons'].append(t.lesson_id)
+                elif t.kind == Tombstone.Kinds.STUDENT:
+                    deleted['students'].append(t.student_id)
+                else:
+                    deleted['records'].append([t.student_id, t.lesson_id])
+            reference = DashboardDeltaSerializer({
+                'cursor': 9,
+                'delta': True,
+                'lessons': LessonSerializer(Lesson.objects.filter(version__gt=2), many=True).data,
+                'students': self.reference_students(students),
+                'records': self.reference_records(recs),
+                'deleted': deleted,
+            })
+            self.assertSameBytes(DashboardStateView.delta_data(9, 2, level), reference)
+
+    def test_columnar_records(self):
+        # Decoding the parallel arrays gives back exactly the records map
+        for recs in (Record.objects.all(), Record.objects.filter(student__level="B1"), Record.objects.none()):
+            cols = payloads.records_columns(recs)
+            extra = dict(cols['extra'])
+            decoded = {}
+            for i, (s, l) in enumerate(zip(cols['student'], cols['lesson'])):
+                decoded.setdefault(str(cols['students'][s]), {})[str(cols['lessons'][l])] = {
+                    'attendance': cols['attendance'][i], 'homework': bool(cols['homework'][i]),
+                    'extra': extra.get(i, ''), 'test_score': cols['test_score'][i],
+                    'version': cols['version'][i],
+                }
+            self.assertEqual(decoded, payloads.records_map(recs))
+
+
+def seed_sheet(students_per_level, lessons):
+    """A filled-in sheet: every cell has a record, mostly bare absences as on a real one."""
+    version = ChangeCursor.advance()
+    Lesson.objects.bulk_create([
+        Lesson(title=f"{i + 1}-dars", order=i, date=date(2026, 9, 1), version=version) for i in range(lessons)
+    ])
+    Student.objects.bulk_create([
+        Student(name=f"s{i}", level=level, version=version)
+        for level in Student.Levels.values
+        for i in range(students_per_level)
+    ])
+    # Everyone joined before the first lesson, so every record counts
+    Student.objects.update(joined_at=date(2026, 8, 15))
+    lesson_ids = list(Lesson.objects.values_list('id', flat=True))
+    records = [
+        Record(
+            student_id=sid, lesson_id=lid, attendance='P' if (n + lid) % 20 == 0 else 'A',
+            homework=(n + lid) % 7 == 0, version=version,
+        )
+        for n, sid in enumerate(Student.objects.values_list('id', flat=True))
+        for lid in lesson_ids
+    ]
+    Record.objects.bulk_create(records, batch_size=2000)
+    summaries.rebuild()
+    state_cache.record_change(version)
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries are served by the indexes added for them."""
+
+    STUDENTS_PER_LEVEL = 300
+    LESSONS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(cls.STUDENTS_PER_LEVEL, cls.LESSONS)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tables this small are cheaper to scan whole; ask for the best indexed plan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+
+    def test_level_page(self):
+        self.assertUsesIndex(
+            Student.objects.filter(level="B1", id__gt=0).order_by('id')[:501], 'student_level_id_idx'
+        )
+
+    def test_lesson_order(self):
+        self.assertUsesIndex(Lesson.objects.all(), 'lesson_order_id_idx')
+
+    def test_records_of_lesson(self):
+        lesson = Lesson.objects.last()
+        self.assertUsesIndex(Record.objects.filter(lesson=lesson), 'record_lesson_student_idx')
+
+    # SQLite does not weigh partial indexes by their size and keeps to the full ones
+    @skipUnless(connection.vendor == 'postgresql', "partial index choice is PostgreSQL's")
+    def test_meaningful_exists(self):
+        meaningful = Record.objects.meaningful()
+        self.assertUsesIndex(
+            Student.objects.filter(Exists(meaningful.filter(student=OuterRef('pk')))),
+            'record_meaningful_student_idx',
+        )
+        self.assertUsesIndex(
+            Lesson.objects.filter(Exists(meaningful.filter(lesson=OuterRef('pk')))),
+            'record_meaningful_lesson_idx',
+        )
+
+
+class QueryBudgetTests(TestCase):
+    """Queries per request stay fixed however large the school is."""
+
+    STUDENTS_PER_LEVEL = 200
+    LESSONS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(cls.STUDENTS_PER_LEVEL, cls.LESSONS)
+        cls.admin = User.objects.create_user(username='admin', password='pw', role=User.Roles.ADMIN)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.lesson_ids = list(Lesson.objects.values_list('id', flat=True))
+        self.b1 = list(Student.objects.filter(level="B1").order_by('id').values_list('id', flat=True))
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with instrumentation.record_queries(keep_statements=True) as stats:
+            yield stats
+        self.assertLessEqual(
+            stats.count, budget, f"{stats.count} queries, budget {budget}:\n" + "\n".join(stats.statements)
+        )
+
+    def request(self, budget, method, url, data=None):
+        body = json.dumps(data) if data is not None else ''
+        with self.assertQueryBudget(budget):
+            response = self.client.generic(method, url, body, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 500)
+        return response
+
+    def cells(self, count):
+        return [
+            [sid, lid, 'attendance', 'P']
+            for sid in self.b1[:count // len(self.lesson_ids) + 1]
+            for lid in self.lesson_ids
+        ][:count]
+
+    def test_pages(self):
+        self.request(2, 'GET', '/')
+        self.request(0, 'GET', '/login/')
+        self.request(4, 'POST', '/logout/')
+
+    def test_state(self):
+        response = self.request(6, 'GET', '/dashboard/state/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="6 queries", total;dur=[\d.]+$')
+        # Served from the snapshot cache
+        response = self.request(3, 'GET', '/dashboard/state/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.request(6, 'GET', '/dashboard/state/?format=columnar')
+        response = self.request(6, 'GET', '/dashboard/state/?level=B1&limit=50')
+        self.request(6, 'GET', f'/dashboard/state/?level=B1&after={response.json()["next"]}')
+        self.request(7, 'GET', '/dashboard/state/?since=0')
+        self.request(7, 'GET', '/dashboard/state/?level=A0&since=0&format=columnar')
+        etag = self.client.get('/dashboard/state/')['ETag']
+        with self.assertQueryBudget(3):
+            self.assertEqual(self.client.get('/dashboard/state/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    # Write payloads stay within one bulk batch on every backend (SQLite splits
+    # statements at 999 parameters), so any extra query is a per-item one.
+    # Saves include the SAVEPOINT that lets a save writing nothing undo advance().
+
+    def test_save(self):
+        self.request(26, 'POST', '/dashboard/save/', {
+            'records': {
+                str(sid): {str(lid): {'attendance': 'E', 'homework': True} for lid in self.lesson_ids[:10]}
+                for sid in self.b1[:10]
+            },
+            'students': [{'id': sid, 'name': f"n{sid}", 'note': ''} for sid in self.b1[:30]],
+            'lessons': [{'id': lid, 'date': '2026-09-02'} for lid in self.lesson_ids],
+        })
+
+    def test_cells(self):
+        self.request(21, 'PATCH', '/dashboard/cells/', {'changes': self.cells(100)})
+        self.request(18, 'PATCH', '/dashboard/cells/', {
+            'changes': [[sid, None, 'name', 'x'] for sid in self.b1[:30]] + [[None, self.lesson_ids[0], 'date', None]],
+        })
+
+    def test_noop_save_keeps_etag(self):
+        etag = self.client.get('/dashboard/state/')['ETag']
+        record = Record.objects.filter(student_id=self.b1[0]).order_by('lesson_id').first()
+        stale = self.client.patch('/dashboard/cells/', {
+            'changes': [[record.student_id, record.lesson_id, 'attendance', 'P', record.version + 1]],
+        }, content_type='application/json')
+        self.assertEqual((stale.json()['version'], len(stale.json()['conflicts'])), (None, 1))
+        for payload in ({}, {'records': {str(record.student_id): {str(record.lesson_id): {
+            'attendance': record.attendance, 'homework': record.homework,
+        }}}}):
+            with self.subTest(payload=payload):
+                response = self.client.post('/dashboard/save/', payload, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.client.get('/dashboard/state/')['ETag'], etag)
+        self.assertEqual(Record.objects.get(pk=record.pk).version, record.version)
+
+    def test_structure(self):
+        self.request(14, 'POST', '/dashboard/lesson/add/')
+        self.request(19, 'POST', '/dashboard/lesson/remove/')
+        self.request(13, 'POST', '/dashboard/student/add/', {'level': "B1"})
+        self.request(20, 'POST', '/dashboard/student/remove/', {'level': "B1"})
+        # Plus a SELECT and a DELETE, in a savepoint here, per deletions.CHUNK_SIZE
+        # records; the final transaction takes a savepoint of its own
+        self.request(50, 'POST', '/dashboard/clear/')
+
+    def test_stats(self):
+        self.request(5, 'GET', f'/dashboard/stats/?student={self.b1[0]}')
+        self.request(5, 'GET', '/dashboard/stats/?level=B1')
+        self.request(5, 'GET', '/dashboard/stats/')
+
+    def test_cache_counters(self):
+        self.request(2, 'GET', '/dashboard/cache/')
+        self.request(2, 'DELETE', '/dashboard/cache/')
+
+    def test_export(self):
+        # What /dashboard/export/ runs on the export pool (see ExportTests). The
+        # export's transaction is a savepoint here: SAVEPOINT and RELEASE
+        with self.assertQueryBudget(6):
+            exports.export_tempfile('csv').close()
+        response = self.request(8, 'POST', '/dashboard/export/jobs/?type=csv')
+        job = response.json()['id']
+        self.request(3, 'GET', f'/dashboard/export/jobs/{job}/')
+        self.request(3, 'GET', f'/dashboard/export/jobs/{job}/download/')
+
+    def test_events(self):
+        self.request(2, 'GET', '/dashboard/events/?level=B1')
+
+    def test_import(self):
+        sheet = "#,Ism Familiya,Daraja,Izoh,1-dars,2-dars,3-dars\n" + "".join(
+            f"{i},s{i},B1,,+,−,\n" for i in range(30)
+        ) + "30,new,B1,,+,,\n"
+        upload = SimpleUploadedFile('sheet.csv', sheet.encode())
+        with self.assertQueryBudget(27):
+            response = self.client.post('/dashboard/import/', {'file': upload})
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+class DeltaSyncTests(TestCase):
+    """?since=<cursor> sends what changed after the cursor, until a clear-all."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(2, 2)
+        cls.admin = User.objects.create_user(username='admin', password='pw', role=User.Roles.ADMIN)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def state(self, query=''):
+        response = self.client.get(f'/dashboard/state/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_same_second_write_not_modified_since(self):
+        first = self.client.get('/dashboard/state/')
+        student = Student.objects.filter(level="B1").first()
+        self.client.patch('/dashboard/cells/', {'changes': [[student.id, None, 'name', 'Same second']]},
+                          content_type='application/json')
+        # Last-Modified is rounded up, so the write may well share its second
+        response = self.client.get('/dashboard/state/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cursor'], first.json()['cursor'] + 1)
+        response = self.client.get('/dashboard/state/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_and_tombstones(self):
+        cursor = self.state()['cursor']
+        b1 = list(Student.objects.filter(level="B1").order_by('id'))
+        a1 = Student.objects.filter(level="A1").first()
+        l0, l1 = Lesson.objects.values_list('id', flat=True)
+        response = self.client.patch('/dashboard/cells/', {'changes': [
+            [b1[0].id, l0, 'extra', 'late'],
+            # Blank: the record is deleted
+            [b1[1].id, l1, 'attendance', ''],
+            [b1[1].id, l1, 'homework', False],
+            [a1.id, None, 'name', 'Renamed'],
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        delta = self.state(f'?since={cursor}')
+        self.assertTrue(delta['delta'])
+        self.assertEqual(delta['lessons'], [])
+        self.assertEqual({level: [s['id'] for s in rows] for level, rows in delta['students'].items()}, {'A1': [a1.id]})
+        self.assertEqual({sid: list(rows) for sid, rows in delta['records'].items()}, {str(b1[0].id): [str(l0)]})
+        self.assertEqual(delta['records'][str(b1[0].id)][str(l0)]['extra'], 'late')
+        self.assertEqual(delta['deleted'], {'lessons': [], 'students': [], 'records': [[b1[1].id, l1]]})
+
+        # Scoped to a level, and empty once caught up
+        delta = self.state(f'?level=A1&since={cursor}')
+        self.assertEqual((delta['records'], delta['deleted']['records']), ({}, []))
+        caught_up = self.state(f'?since={delta["cursor"]}')
+        self.assertEqual((caught_up['students'], caught_up['records']), ({}, {}))
+
+    def test_clear_forces_snapshot(self):
+        cursor = self.state()['cursor']
+        self.assertEqual(self.client.post('/dashboard/clear/').status_code, 200)
+        state = self.state(f'?since={cursor}')
+        self.assertFalse(state['delta'])
+        self.assertGreater(state['cursor'], cursor)
+        self.assertEqual(state['records'], {})
+        self.assertEqual(len(state['students']['B1']), 2)
+        # Cursors from after the clear get deltas again
+        self.assertTrue(self.state(f'?since={state["cursor"]}')['delta'])
+
+
+class StateCacheTests(TestCase):
+    """Cached snapshots are invalidated per level."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(2, 2)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.teacher)
+
+    def cached(self, queries):
+        return {q: self.client.get(f'/dashboard/state/{q}')['X-Cache'] for q in queries}
+
+    def test_level_invalidation(self):
+        pages = ('?level=A1', '?level=B1', '')
+        self.assertEqual(self.cached(pages), dict.fromkeys(pages, 'MISS'))
+        self.assertEqual(self.cached(pages), dict.fromkeys(pages, 'HIT'))
+        student = Student.objects.filter(level="B1").first()
+        self.client.patch('/dashboard/cells/', {
+            'changes': [[student.id, Lesson.objects.first().id, 'extra', 'x']],
+        }, content_type='application/json')
+        self.assertEqual(self.cached(pages), {'?level=A1': 'HIT', '?level=B1': 'MISS', '': 'MISS'})
+        # Lessons belong to every level
+        self.client.post('/dashboard/lesson/add/')
+        self.assertEqual(self.cached(pages), dict.fromkeys(pages, 'MISS'))
+
+
+class CompressionTests(TestCase):
+    """Accept-Encoding negotiation and what CompressionMiddleware leaves alone."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(5, 4)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    def respond(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/', headers={'accept-encoding': accept_encoding})
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_negotiation(self):
+        encoders = [compression.Brotli, compression.Gzip]
+        for header, expected in [
+            ('gzip', 'gzip'),
+            ('gzip, br', 'br'),
+            ('br;q=0.5, gzip;q=0.8', 'gzip'),
+            ('br;q=0, *', 'gzip'),
+            ('*;q=0.3', 'br'),
+            ('GZIP ; q=1.0', 'gzip'),
+            ('gzip;q=0', None),
+            ('gzip;q=abc', None),
+            ('identity', None),
+            ('', None),
+        ]:
+            with self.subTest(header=header):
+                encoder = compression.choose_encoder(header, encoders)
+                self.assertEqual(encoder and encoder.name, expected)
+
+    def test_min_size(self):
+        body = json.dumps({'x': 'a' * 100}).encode()
+        small = self.respond(HttpResponse(body, content_type='application/json'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertEqual(small.content, body)
+        body = json.dumps({'x': 'a' * 5000}).encode()
+        large = self.respond(HttpResponse(body, content_type='application/json; charset=utf-8'))
+        self.assertEqual(large['Content-Encoding'], 'gzip')
+        self.assertEqual(int(large['Content-Length']), len(large.content))
+        self.assertEqual(gzip.decompress(large.content), body)
+
+    def test_vary(self):
+        body = b'1,2\n' * 1000
+        response = self.respond(HttpResponse(body, content_type='text/csv'), accept_encoding='identity')
+        # Another client may get it compressed, so caches must key on the header
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, body)
+
+    def test_streaming(self):
+        rows = [f'{i},{"x" * (i % 50)}\n' for i in range(20000)]
+        response = self.respond(StreamingHttpResponse(iter(rows), content_type='text/csv'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), ''.join(rows))
+
+    async def test_async_streaming(self):
+        rows = [f'{i}\n' for i in range(20000)]
+
+        async def stream():
+            for row in rows:
+                yield row
+
+        response = self.respond(StreamingHttpResponse(stream(), content_type='text/csv'))
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(gzip.decompress(body).decode(), ''.join(rows))
+
+    def test_event_stream_untouched(self):
+        response = self.respond(StreamingHttpResponse(iter(['data: x\n\n'] * 100), content_type='text/event-stream'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_weak_etag(self):
+        self.client.force_login(self.teacher)
+        response = self.client.get('/dashboard/state/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(json.loads(gzip.decompress(response.content))['cursor'], ChangeCursor.load().value)
+        for etag in (response['ETag'], response['ETag'][2:]):
+            with self.subTest(etag=etag):
+                cached = self.client.get(
+                    '/dashboard/state/', headers={'accept-encoding': 'gzip', 'if-none-match': etag}
+                )
+                self.assertEqual(cached.status_code, 304)
+                # The same validator as the 200 it revalidates
+                self.assertEqual(cached['ETag'], response['ETag'])
+        plain = self.client.get('/dashboard/state/', headers={'if-none-match': response['ETag']})
+        self.assertEqual((plain.status_code, plain['ETag']), (304, response['ETag'][2:]))
+
+
+class StatsTests(TestCase):
+    def test_percent_rounds_half_up(self):
+        # 12.5 and 62.5 round up, as Math.round does; round() would give 12 and 62
+        cases = [(1, 8, 13), (5, 8, 63), (1, 200, 1), (1, 3, 33), (2, 3, 67), (0, 7, 0), (3, 0, 0)]
+        for part, total, expected in cases:
+            with self.subTest(part=part, total=total):
+                self.assertEqual(percent(part, total), expected)
+
+
+class SaveTests(TestCase):
+    """The bulk full-grid save: validation first, then one diff against the stored rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(2, 3)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+        self.s0, self.s1 = Student.objects.filter(level="B1").order_by('id').values_list('id', flat=True)
+        self.l0, self.l1, self.l2 = Lesson.objects.values_list('id', flat=True)
+
+    def save(self, payload):
+        return self.client.post('/dashboard/save/', payload, content_type='application/json')
+
+    def test_invalid_payload_writes_nothing(self):
+        before = ChangeCursor.load().value
+        records = list(Record.objects.order_by('id').values_list('id', 'attendance', 'version'))
+        response = self.save({
+            'records': {
+                str(self.s0): {str(self.l0): {'attendance': 'E'}},
+                str(self.s1): {str(self.l0): {'attendance': 'P', 'extra': 'x' * 300}},
+            },
+            'students': [{'id': self.s0, 'name': 'ok'}, {'id': self.s1, 'name': 'n' * 200}],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'invalid_payload')
+        self.assertEqual(
+            [(e.get('student_id'), e.get('lesson_id')) for e in response.json()['errors']],
+            [(str(self.s1), str(self.l0)), (self.s1, None)],
+        )
+        self.assertEqual(ChangeCursor.load().value, before)
+        self.assertEqual(list(Record.objects.order_by('id').values_list('id', 'attendance', 'version')), records)
+        self.assertFalse(Student.objects.filter(name='ok').exists())
+
+    def test_upsert_and_delete(self):
+        Record.objects.filter(student_id=self.s0, lesson_id=self.l0).delete()
+        kept = Record.objects.get(student_id=self.s0, lesson_id=self.l2)
+        response = self.save({'records': {
+            str(self.s0): {
+                # new, emptied, unchanged
+                str(self.l0): {'attendance': 'P'},
+                str(self.l1): {},
+                str(self.l2): {'attendance': kept.attendance, 'homework': kept.homework},
+            },
+            str(self.s1): {str(self.l0): {'attendance': 'E', 'homework': True, 'extra': ' x ', 'test_score': 5}},
+        }})
+        self.assertEqual(response.json(), {'status': 'ok', 'conflicts': []})
+        version = ChangeCursor.load().value
+        rows = {
+            (sid, lid): rest
+            for sid, lid, *rest in Record.objects.filter(student_id__in=(self.s0, self.s1)).values_list(
+                'student_id', 'lesson_id', 'attendance', 'homework', 'extra', 'test_score', 'version'
+            )
+        }
+        self.assertEqual(rows[(self.s0, self.l0)], ['P', False, '', 0, version])
+        self.assertNotIn((self.s0, self.l1), rows)
+        self.assertEqual(rows[(self.s0, self.l2)][-1], kept.version)
+        self.assertEqual(rows[(self.s1, self.l0)], ['E', True, 'x', 5, version])
+        self.assertEqual(
+            list(Tombstone.objects.filter(version=version).values_list('kind', 'student_id', 'lesson_id')),
+            [('R', self.s0, self.l1)],
+        )
+
+
+class ConflictTests(TestCase):
+    """Per-row versions: an edit based on a stale version is reported, not applied."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(1, 2)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+        self.student = Student.objects.get(level="B1")
+        self.lesson = Lesson.objects.first()
+        self.record = Record.objects.get(student=self.student, lesson=self.lesson)
+        # Someone else's later write
+        version = ChangeCursor.advance()
+        Record.objects.filter(pk=self.record.pk).update(extra="theirs", version=version)
+        Student.objects.filter(pk=self.student.pk).update(name="theirs", version=version)
+        Lesson.objects.filter(pk=self.lesson.pk).update(date=date(2026, 9, 2), version=version)
+        self.current = version
+
+    def rows(self):
+        return (
+            Record.objects.values_list('extra', 'version').get(pk=self.record.pk),
+            Student.objects.values_list('name', 'version').get(pk=self.student.pk),
+            Lesson.objects.values_list('date', 'version').get(pk=self.lesson.pk),
+        )
+
+    def assertConflicts(self, response):
+        self.assertEqual(response.status_code, 200)
+        # Cells, then students, then lessons
+        self.assertEqual(
+            [(c.get('student_id'), c.get('lesson_id'), c['version']) for c in response.json()['conflicts']],
+            [
+                (self.student.id, self.lesson.id, self.current),
+                (self.student.id, None, self.current),
+                (None, self.lesson.id, self.current),
+            ],
+        )
+        self.assertEqual(self.rows(), (
+            ("theirs", self.current), ("theirs", self.current), (date(2026, 9, 2), self.current),
+        ))
+
+    def test_save(self):
+        stale = self.record.version
+        cell = {'attendance': 'P', 'extra': 'mine'}
+        response = self.client.post('/dashboard/save/', {
+            'records': {str(self.student.id): {str(self.lesson.id): {**cell, 'version': stale}}},
+            'students': [{'id': self.student.id, 'name': 'mine', 'note': '', 'version': stale}],
+            'lessons': [{'id': self.lesson.id, 'date': '2026-09-03', 'version': stale}],
+        }, content_type='application/json')
+        self.assertConflicts(response)
+        response = self.client.post('/dashboard/save/', {
+            'records': {str(self.student.id): {str(self.lesson.id): {**cell, 'version': self.current}}},
+        }, content_type='application/json')
+        self.assertEqual(response.json()['conflicts'], [])
+        self.assertEqual(self.rows()[0], ("mine", ChangeCursor.load().value))
+
+    def test_cells(self):
+        stale = self.record.version
+        response = self.client.patch('/dashboard/cells/', {'changes': [
+            [self.student.id, self.lesson.id, 'extra', 'mine', stale],
+            [self.student.id, None, 'name', 'mine', stale],
+            [None, self.lesson.id, 'date', '2026-09-03', stale],
+        ]}, content_type='application/json')
+        self.assertConflicts(response)
+        response = self.client.patch('/dashboard/cells/', {'changes': [
+            [self.student.id, None, 'name', 'mine', self.current],
+        ]}, content_type='application/json')
+        self.assertEqual(response.json()['conflicts'], [])
+        self.assertEqual(self.rows()[1], ("mine", response.json()['version']))
+
+
+class SummaryTests(TestCase):
+    """The stats summaries follow every write path without a rebuild."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # More than the 30 students per level that removal keeps
+        seed_sheet(31, 4)
+        # Some students joined after the lessons' date: their records don't count yet
+        Student.objects.filter(level="B1", id__in=Student.objects.filter(level="B1").order_by('id')[:5]).update(
+            joined_at=date(2026, 9, 10)
+        )
+        summaries.rebuild()
+        cls.admin = User.objects.create_user(username='admin', password='pw', role=User.Roles.ADMIN)
+
+    def assertNoDrift(self):
+        self.assertEqual(summaries.verify(), [])
+        out = io.StringIO()
+        call_command('rebuild_summaries', '--verify', stdout=out)
+        self.assertIn("up to date", out.getvalue())
+
+    def test_write_paths(self):
+        self.client.force_login(self.admin)
+        b1 = list(Student.objects.filter(level="B1").order_by('id').values_list('id', flat=True))
+        lessons = list(Lesson.objects.values_list('id', flat=True))
+
+        def post(url, data=None, method='post'):
+            response = getattr(self.client, method)(url, data or {}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        steps = [
+            ('save', lambda: post('/dashboard/save/', {'records': {
+                str(sid): {
+                    str(lessons[0]): {'attendance': 'P', 'homework': True, 'test_score': 7},
+                    str(lessons[1]): {},
+                }
+                for sid in b1[:8]
+            }})),
+            ('cells', lambda: post('/dashboard/cells/', {'changes': [
+                [b1[0], lessons[2], 'attendance', 'E'],
+                [b1[6], lessons[0], 'test_score', 3],
+                [b1[7], lessons[0], 'attendance', ''],
+                [b1[7], lessons[0], 'homework', False],
+                [b1[7], lessons[0], 'test_score', 0],
+            ]}, method='patch')),
+            # Later than the late joiners' date: their records start counting
+            ('date', lambda: post('/dashboard/save/', {'lessons': [{'id': lessons[0], 'date': '2026-09-15'}]})),
+            ('lesson date cleared', lambda: post('/dashboard/cells/', {
+                'changes': [[None, lessons[1], 'date', None]],
+            }, method='patch')),
+            ('lesson removed', lambda: post('/dashboard/lesson/remove/')),
+            ('student removed', lambda: post('/dashboard/student/remove/', {'level': "B1"})),
+        ]
+        for name, step in steps:
+            with self.subTest(step=name):
+                step()
+                self.assertNoDrift()
+        self.assertEqual(Lesson.objects.count(), 3)
+        self.assertEqual(Student.objects.filter(level="B1").count(), 30)
+
+
+class ImportTests(TestCase):
+    """Sheets in the export's layout import back into the same dashboard."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(5, 4)
+        Student.objects.filter(level="A1").update(note="n")
+
+    def export_csv(self):
+        return ''.join(exports.iter_csv())
+
+    def test_round_trip(self):
+        sheet = self.export_csv()
+        students = Student.objects.count()
+        # Marks are what the sheet carries; homework etc. must survive the import
+        Record.objects.update(attendance='A')
+        summaries.rebuild()
+        result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())), chunk_size=7)
+        self.assertEqual(result.error_count, 0)
+        self.assertEqual(result.students_created, 0)
+        self.assertEqual(result.lessons_created, 0)
+        self.assertEqual(Student.objects.count(), students)
+        self.assertEqual(self.export_csv(), sheet)
+        self.assertTrue(Record.objects.filter(homework=True).exists())
+        self.assertEqual(summaries.verify(), [])
+
+    def test_new_rows_and_errors(self):
+        sheet = (
+            "#,Ism Familiya,Daraja,Izoh,1-dars,Yangi\n"
+            "1,s0,a0,,x,+\n"
+            "2,Ali,B2,izoh,−,\n"
+            "3,Vali,Z9,,+,\n"
+            "4,Soli,C1,,?,\n"
+        )
+        cursor = ChangeCursor.load().value
+        result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())))
+        self.assertEqual(result.rows, 2)
+        self.assertEqual(result.students_created, 1)
+        self.assertEqual(result.lessons_created, 1)
+        self.assertEqual([e['row'] for e in result.errors], [4, 5])
+        ali = Student.objects.get(name="Ali")
+        self.assertEqual((ali.level, ali.note), ("B2", "izoh"))
+        # Lessons are dated 2026-09-01, so the new student joined at the first of them
+        self.assertEqual(ali.joined_at, date(2026, 9, 1))
+        lesson = Lesson.objects.get(title="Yangi")
+        s0 = Student.objects.get(level="A0", name="s0")
+        self.assertEqual(Record.objects.get(student=s0, lesson=lesson).attendance, 'P')
+        self.assertTrue(ChangeCursor.load().value > cursor)
+        self.assertEqual(summaries.verify(), [])
+
+    def test_invalid_header(self):
+        for header in (
+            b"#,Ism Familiya,Daraja,Izoh,1-dars,1-dars\n",
+            b"name,email,phone,city,zip,country\n1,a,b,c,d,e\n",
+            b"#,Ism Familiya,Daraja\n",
+        ):
+            with self.subTest(header=header), self.assertRaises(imports.InvalidSheet):
+                imports.import_rows(imports.read_csv(io.BytesIO(header)))
+        self.assertFalse(Lesson.objects.filter(order__gte=4).exists())
+
+    def test_no_valid_rows(self):
+        cursor = ChangeCursor.load().value
+        sheet = "#,Ism Familiya,Daraja,Izoh,Yangi\n1,Ali,Z9,,+\n"
+        result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())))
+        self.assertEqual((result.rows, result.lessons_created, result.error_count), (0, 0, 1))
+        self.assertFalse(Lesson.objects.filter(title="Yangi").exists())
+        self.assertEqual(ChangeCursor.load().value, cursor)
+
+    def test_unnamed_rows(self):
+        sheet = "#,Ism Familiya,Daraja,Izoh,1-dars\n1,,B1,,+\n2,,B1,,−\n3,,C1,,+\n"
+        students = Student.objects.count()
+        for _ in range(2):
+            result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())), chunk_size=1)
+            self.assertEqual(result.error_count, 0)
+        self.assertEqual(Student.objects.count(), students + 3)
+        self.assertEqual(
+            list(Record.objects.filter(student__name="", lesson__title="1-dars").order_by('student_id')
+                 .values_list('student__level', 'attendance')),
+            [("B1", 'P'), ("B1", 'E'), ("C1", 'P')],
+        )
+
+    def test_blank_chunk_keeps_cursor(self):
+        # Known students, no new lessons and no marks: nothing to write
+        sheet = "#,Ism Familiya,Daraja,Izoh,1-dars\n1,s0,A0,,\n2,s1,A0,,\n3,s0,B1,,+\n"
+        cursor = ChangeCursor.load().value
+        result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())), chunk_size=2)
+        self.assertEqual((result.rows, result.cells), (3, 1))
+        # Only the second chunk took a change sequence
+        self.assertEqual(ChangeCursor.load().value, cursor + 1)
+
+    def test_duplicate_names(self):
+        # s1 is in B1 once already; the sheet has it twice, plus a new name twice
+        sheet = (
+            "#,Ism Familiya,Daraja,Izoh,1-dars\n"
+            "1,s1,B1,first,+\n2,s1,B1,second,−\n3,Ali,C1,,+\n4,Ali,C1,,−\n"
+        )
+        existing = Student.objects.get(level="B1", name="s1")
+        students = Student.objects.count()
+        for _ in range(2):
+            result = imports.import_rows(imports.read_csv(io.BytesIO(sheet.encode())), chunk_size=3)
+            self.assertEqual(result.error_count, 0)
+        self.assertEqual(Student.objects.count(), students + 3)
+        self.assertEqual(
+            list(Record.objects.filter(student__level="B1", student__name="s1", lesson__title="1-dars")
+                 .order_by('student_id').values_list('student__name', 'student__note', 'attendance')),
+            [("s1", "first", 'P'), ("s1", "second", 'E')],
+        )
+        self.assertEqual(
+            list(Record.objects.filter(student__name="Ali", lesson__title="1-dars")
+                 .order_by('student_id').values_list('student__level', 'attendance')),
+            [("C1", 'P'), ("C1", 'E')],
+        )
+        self.assertEqual(Student.objects.filter(level="B1", name="s1").first(), existing)
+        self.assertEqual(summaries.verify(), [])
+
+
+
+class DeletionTests(TestCase):
+    """Chunked clear-all, its snapshot, and restoring the snapshot."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(5, 4)
+        Student.objects.filter(level="A1").update(note="n")
+        Record.objects.filter(student__level="B1").update(attendance='P', homework=True, extra="x")
+        summaries.rebuild()
+
+    def sheet(self):
+        return (
+            list(Record.objects.order_by('student_id', 'lesson_id').values_list(
+                'student_id', 'lesson_id', 'attendance', 'homework', 'extra', 'test_score'
+            )),
+            list(Student.objects.order_by('id').values_list('id', 'name', 'note')),
+        )
+
+    def test_clear_and_restore(self):
+        before = self.sheet()
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        version, path = deletions.clear_all(chunk_size=7, snapshot_root=root)
+        self.assertFalse(Record.objects.exists())
+        self.assertFalse(Student.objects.exclude(name="", note="").exists())
+        self.assertEqual(ChangeCursor.load().reset_at, version)
+        self.assertEqual(summaries.verify(), [])
+        self.assertEqual([p.name for p in Path(root).iterdir()], [path.name])
+
+        with open(path, 'rb') as f:
+            self.assertEqual(deletions.restore(f, chunk_size=10), (30, len(before[0])))
+        self.assertEqual(self.sheet(), before)
+        self.assertEqual(summaries.verify(), [])
+
+    def test_invalid_snapshot(self):
+        with self.assertRaises(deletions.InvalidSnapshot):
+            deletions.restore(io.BytesIO(b"not gzip"))
+
+    def test_damaged_snapshot_writes_nothing(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        _, path = deletions.clear_all(snapshot_root=root)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = f.readlines()
+        complete = gzip.compress(''.join(lines).encode())
+        cursor = ChangeCursor.load().value
+        for name, data in [
+            ('bad json', lines[:3] + ['["R", 1,\n'] + lines[3:]),
+            ('short record', lines[:3] + ['["R", 1, 2, "P"]\n'] + lines[3:]),
+            ('unknown kind', lines + ['["X", 1]\n']),
+            ('truncated', complete[:len(complete) // 2]),
+        ]:
+            with self.subTest(name):
+                fileobj = io.BytesIO(data if isinstance(data, bytes) else gzip.compress(''.join(data).encode()))
+                with self.assertRaises(deletions.InvalidSnapshot):
+                    deletions.restore(fileobj, chunk_size=2)
+                self.assertFalse(Record.objects.exists())
+                self.assertEqual(ChangeCursor.load().value, cursor)
+
+    def test_noop_clear_and_restore(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        _, path = deletions.clear_all(chunk_size=7, snapshot_root=root)
+        cursor = ChangeCursor.load().value
+        self.assertEqual(deletions.clear_all(snapshot_root=root), (None, None))
+        self.assertEqual(ChangeCursor.load().value, cursor)
+        # No archive of nothing is left behind
+        self.assertEqual([p.name for p in Path(root).iterdir()], [path.name])
+
+        with open(path, 'rb') as f:
+            deletions.restore(f, chunk_size=10)
+        cursor = ChangeCursor.load().value
+        with open(path, 'rb') as f:
+            deletions.restore(f, chunk_size=10)
+        self.assertEqual(ChangeCursor.load().value, cursor)
+
+    async def test_restore_command_notifies(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        _, path = await sync_to_async(deletions.clear_all)(snapshot_root=root)
+        broker = events.LocalBroker()
+        sub = broker.subscribe('B1')
+
+        def restore():
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('restore_snapshot', str(path), stdout=io.StringIO())
+
+        with mock.patch.object(events, '_broker', broker):
+            await sync_to_async(restore)()
+        await asyncio.sleep(0)
+        self.assertTrue(json.loads(await sub.get())['students']['B1'])
+
+
+class AsgiViewTests(TestCase):
+    """The async read endpoints under ASGI (AsyncClient sends ASGI requests)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(5, 4)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_state_and_stats(self):
+        response = await self.async_client.get('/dashboard/state/')
+        self.assertEqual(response.status_code, 403)
+        await self.async_client.aforce_login(self.teacher)
+        response = await self.async_client.get('/dashboard/state/?level=B1&since=0&format=columnar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['students']['B1']), 5)
+        response = await self.async_client.get('/dashboard/state/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        cached = await self.async_client.get('/dashboard/state/', headers={'if-none-match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        response = await self.async_client.get('/dashboard/stats/?level=B1')
+        self.assertEqual((response.json()['students'], response.json()['total']), (5, 20))
+
+    async def test_page_limit(self):
+        await self.async_client.aforce_login(self.teacher)
+        for limit in ('0', '-1', 'x'):
+            with self.subTest(limit=limit):
+                response = await self.async_client.get(f'/dashboard/state/?level=B1&limit={limit}')
+                self.assertEqual((response.status_code, response.json()), (400, {'error': 'invalid_page'}))
+        response = await self.async_client.get('/dashboard/state/?level=B1&limit=2000')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # Capped before the cache key is made
+        response = await self.async_client.get('/dashboard/state/?level=B1&limit=5000')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    async def test_async_middleware(self):
+        await self.async_client.aforce_login(self.teacher)
+        response = await self.async_client.get('/dashboard/state/', headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+        async def get_response(request):
+            return await DashboardStateView.as_view()(request)
+
+        # Both run as coroutines when the chain below them is async
+        for middleware in (instrumentation.InstrumentationMiddleware, compression.CompressionMiddleware):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(get_response)))
+                self.assertFalse(iscoroutinefunction(middleware(lambda request: None)))
+
+    async def test_me(self):
+        response = await self.async_client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"detail": "Authentication credentials were not provided."})
+        response = await self.async_client.get('/api/users/me/', headers={'authorization': 'Bearer nonsense'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'token_not_valid')
+        self.assertIn('detail', response.json())
+        token = RefreshToken.for_user(self.teacher).access_token
+        response = await self.async_client.get('/api/users/me/', headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(response.json()['username'], 'teacher')
+
+
+class ExportTests(TransactionTestCase):
+    """Direct downloads, built on the export pool: its threads only see committed data."""
+
+    def setUp(self):
+        seed_sheet(5, 4)
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(EXPORT_ROOT=self.root))
+
+    async def test_csv_export(self):
+        await self.async_client.aforce_login(self.teacher)
+        response = await self.async_client.get('/dashboard/export/?type=csv')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body, ''.join(await sync_to_async(lambda: list(exports.iter_csv()))()))
+
+    def test_csv_export_wsgi(self):
+        self.client.force_login(self.teacher)
+        response = self.client.get('/dashboard/export/?type=csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="dashboard.csv"')
+        self.assertEqual(b''.join(response.streaming_content).decode(), ''.join(exports.iter_csv()))
+
+    async def test_cached_export_pruned(self):
+        await self.async_client.aforce_login(self.teacher)
+        version = (await ChangeCursor.aload()).value
+        path = await sync_to_async(exports.build_artifact)(version, 'csv')
+        response = await self.async_client.get('/dashboard/export/?type=csv')
+        cached = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(cached, path.read_bytes())
+        # Once pruned, the export is built again
+        path.unlink()
+        response = await self.async_client.get('/dashboard/export/?type=csv')
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), cached)
+
+
+class EventsTests(TestCase):
+    """Change events through the in-process broker; no external service needed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_sheet(2, 2)
+        cls.teacher = User.objects.create_user(username='teacher', password='pw', role=User.Roles.TEACHER)
+
+    async def test_fan_out(self):
+        broker = events.LocalBroker()
+        first, second, other = broker.subscribe('B1'), broker.subscribe('B1'), broker.subscribe('A1')
+        self.assertEqual(broker.channels(), {'B1', 'A1'})
+        broker.publish('B1', 'hello')
+        self.assertEqual([await first.get(), await second.get()], ['hello', 'hello'])
+        self.assertTrue(other.queue.empty())
+        for sub in (first, second, other):
+            sub.close()
+        self.assertEqual(broker.channels(), set())
+
+    async def test_overflow_resyncs(self):
+        broker = events.LocalBroker(queue_size=2)
+        sub = broker.subscribe('B1')
+        for n in range(3):
+            broker.publish('B1', str(n))
+        # offer() hands messages over through the event loop
+        await asyncio.sleep(0)
+        self.assertEqual(await sub.get(), events.RESYNC)
+        self.assertTrue(sub.queue.empty())
+        broker.publish('B1', '3')
+        self.assertEqual(await sub.get(), '3')
+
+    async def test_level_filter(self):
+        broker = events.LocalBroker()
+        b1, a1 = broker.subscribe('B1'), broker.subscribe('A1')
+        student = await Student.objects.filter(level='B1').afirst()
+
+        def rename():
+            self.client.force_login(self.teacher)
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(
+                    '/dashboard/cells/', {'changes': [[student.id, None, 'name', 'New', student.version]]},
+                    content_type='application/json',
+                )
+            self.assertEqual(response.status_code, 200)
+
+        with mock.patch.object(events, '_broker', broker):
+            await sync_to_async(rename)()
+        await asyncio.sleep(0)
+        b1_data = json.loads(await b1.get())
+        self.assertEqual([s['name'] for s in b1_data['students']['B1']], ['New'])
+        self.assertEqual(b1_data['since'], b1_data['cursor'] - 1)
+        # Nothing changed in A1
+        self.assertTrue(a1.queue.empty())
+
+    async def test_untouched_levels_not_built(self):
+        broker = events.LocalBroker()
+        a1 = broker.subscribe('A1')
+        student = await Student.objects.filter(level='B1').afirst()
+
+        def rename():
+            self.client.force_login(self.teacher)
+            with self.captureOnCommitCallbacks(execute=True), \
+                    mock.patch.object(DashboardStateView, 'delta_data') as delta_data:
+                self.client.patch(
+                    '/dashboard/cells/', {'changes': [[student.id, None, 'name', 'New', student.version]]},
+                    content_type='application/json',
+                )
+            return delta_data.call_count
+
+        with mock.patch.object(events, '_broker', broker):
+            self.assertEqual(await sync_to_async(rename)(), 0)
+        await asyncio.sleep(0)
+        self.assertTrue(a1.queue.empty())
+
+    async def test_reset_reaches_every_stream(self):
+        broker = events.LocalBroker()
+        subs = [broker.subscribe(level) for level in ('A0', 'C1')]
+        admin = await User.objects.acreate(username='admin', role=User.Roles.ADMIN)
+
+        def clear():
+            self.client.force_login(admin)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post('/dashboard/clear/').status_code, 200)
+
+        with mock.patch.object(events, '_broker', broker):
+            await sync_to_async(clear)()
+        await asyncio.sleep(0)
+        for sub in subs:
+            self.assertTrue(json.loads(await sub.get())['reset'])
+
+    def test_no_stream_under_wsgi(self):
+        self.client.force_login(self.teacher)
+        self.assertEqual(self.client.get('/dashboard/events/?level=B1').status_code, 204)
+        self.assertEqual(self.client.get('/dashboard/events/?level=Z9').status_code, 400)
@@ -1,31 +1,58 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.views import View
 from django.views.generic import TemplateView
 
 from django.db import transaction
+from django.db.models import Q
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, BasePermission
 from rest_framework.authentication import SessionAuthentication
-from django.http import HttpResponse
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.parsers import MultiPartParser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from datetime import date
 
 from .serializers import (
     UserSerializer,
-    DashboardStateSerializer,
     LessonSerializer,
     StudentSerializer,
-    RecordSerializer,
+    ExportJobSerializer,
 )
-from .models import User, Lesson, Student, Record
+from . import deletions, events, exports, imports, payloads, state_cache, stats
+from .services import InvalidPayload, apply_changes, save_grid
+from .models import User, Lesson, Student, Record, ChangeCursor, Tombstone, ExportJob
 
 
-class MeView(APIView):
-    permission_classes = [IsAuthenticated]
+class MeView(View):
+    """The user of the JWT in the ``Authorization: Bearer`` header.
 
-    def get(self, request):
-        serializer = UserSerializer(request.user)
-        return Response(serializer.data)
+    A plain async view, so 401 bodies are built the way DRF's exception
+    handler would for an APIView: ``{"detail": ...}``, or the detail itself
+    when it is a dict (simplejwt's invalid-token errors).
+    """
+
+    async def get(self, request):
+        auth = JWTAuthentication()
+        try:
+            result = await sync_to_async(auth.authenticate)(request)
+            if result is None:
+                raise NotAuthenticated()
+        except (AuthenticationFailed, NotAuthenticated) as exc:
+            data = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+            resp = JsonResponse(data, status=401)
+            resp['WWW-Authenticate'] = auth.authenticate_header(request)
+            return resp
+        return JsonResponse(UserSerializer(result[0]).data)
 
 
 class DashboardView(LoginRequiredMixin, TemplateView):
@@ -58,48 +85,214 @@ class IsAdminOnly(BasePermission):
         return user.is_superuser or user.role == User.Roles.ADMIN
 
 
-class DashboardStateView(APIView):
-    authentication_classes = [SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+class DashboardStateView(View):
+    # Students per page for level-scoped requests (?level=B1&after=<student id>&limit=)
+    PAGE_SIZE = 500
+    MAX_PAGE_SIZE = 2000
+    # Part of the ETag; bump when the response layout changes
+    STATE_REVISION = 1
 
-    def get(self, request):
-        # Seed defaults on first run: 24 lessons for all levels and 30 students per level
-        if Lesson.objects.count() == 0:
-            today = date.today()
-            # create 24 lessons for each level (lessons can be shared or per-level depending on design)
-            for i in range(24):
-                Lesson.objects.create(title=f"{i+1}-dars", order=i, date=today)
-        # Ensure minimum rows per level: 30 students per level
-        level_keys = [choice[0] for choice in Student.Levels.choices]
-        for level in level_keys:
-            qs = Student.objects.filter(level=level)
-            if qs.count() < 30:
-                Student.objects.bulk_create([Student(level=level, name="") for _ in range(30 - qs.count())])
-
-        lessons = Lesson.objects.all()
-        # Group students by all defined levels dynamically
-        level_keys = [choice[0] for choice in Student.Levels.choices]
-        students_by_level = { key: list(Student.objects.filter(level=key)) for key in level_keys }
-
-        # Build records map: student_id -> lesson_id -> data
-        records_map = {}
-        recs = Record.objects.select_related('student', 'lesson').all()
-        for r in recs:
-            sid = str(r.student_id)
-            lid = str(r.lesson_id)
-            records_map.setdefault(sid, {})[lid] = {
-                'attendance': r.attendance,
-                'homework': r.homework,
-                'extra': r.extra,
-                'test_score': r.test_score,
-            }
-
-        data = {
-            'lessons': LessonSerializer(lessons, many=True).data,
-            'students': { key: StudentSerializer(students_by_level[key], many=True).data for key in students_by_level },
-            'records': records_map,
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"error": "not_authenticated"}, status=403)
+        # Read-only: default lessons/rows are created by `manage.py seed_dashboard`.
+        # Read the cursor before the rows: anything committed after this point is
+        # newer than the cursor and will simply be sent again on the next delta.
+        state = await ChangeCursor.aload()
+        level = request.GET.get('level')
+        levels = [c[0] for c in Student.Levels.choices]
+        if level is not None and level not in levels:
+            return JsonResponse({"error": "invalid_level", "levels": levels}, status=400)
+        since = request.GET.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return JsonResponse({"error": "invalid_since"}, status=400)
+        after = limit = None
+        if level is not None:
+            try:
+                after = int(request.GET.get('after', 0))
+                limit = min(int(request.GET.get('limit', self.PAGE_SIZE)), self.MAX_PAGE_SIZE)
+            except ValueError:
+                return JsonResponse({"error": "invalid_page"}, status=400)
+            if limit < 1:
+                return JsonResponse({"error": "invalid_page"}, status=400)
+        # ?format=columnar sends records as parallel arrays (see payloads.records_columns)
+        fmt = request.GET.get('format', 'map')
+        if fmt not in payloads.RECORD_FORMATS:
+            return JsonResponse({"error": "invalid_format", "formats": list(payloads.RECORD_FORMATS)}, status=400)
+
+        # Every write advances the cursor, so it versions any response of this URL.
+        # A matching If-None-Match is answered before any rows are read. Only the
+        # ETag is trusted: two writes can land within one second, which
+        # If-Modified-Since can't tell apart, so it never yields a 304.
+        etag = f'"{self.STATE_REVISION}.{state.value}"'
+        resp = get_conditional_response(request, etag=etag)
+        if resp is None:
+            resp = await self.get_state(state, level, since, after, limit, fmt)
+        resp['ETag'] = etag
+        if state.changed_at:
+            # Rounded up, so no write of that second is dated after it
+            resp['Last-Modified'] = http_date(int(state.changed_at.timestamp()) + 1)
+        # Per-session data: browsers may keep it but must revalidate every time
+        resp['Cache-Control'] = 'private, no-cache'
+        return resp
+
+    async def get_state(self, state, level, since, after, limit, fmt='map'):
+        records = payloads.RECORD_FORMATS[fmt]
+        # Cursors older than the last wholesale wipe cannot be replayed
+        if since is not None and since >= state.reset_at:
+            return await self.get_delta(state.value, since, level, records)
+
+        # Snapshots are served from the encoded-response cache (see state_cache.py)
+        key = state_cache.make_key(self.STATE_REVISION, state, level, after, limit, fmt)
+        rest = await state_cache.aload(key)
+        hit = rest is not None
+        if not hit:
+            if level is not None:
+                body = await self.encoded(self.level_page_data, state.value, level, after, limit, records)
+            else:
+                body = await self.encoded(self.full_data, state.value, records)
+            rest = state_cache.split_cursor(body, state.value)
+            await state_cache.astore(key, rest, settings.STATE_CACHE_TIMEOUT)
+        resp = HttpResponse(state_cache.join_cursor(rest, state.value), content_type='application/json')
+        resp['X-Cache'] = 'HIT' if hit else 'MISS'
+        return resp
+
+    @staticmethod
+    def full_data(cursor, records=payloads.records_map):
+        return {
+            'cursor': cursor,
+            'delta': False,
+            'lessons': payloads.lessons(Lesson.objects.all()),
+            # Every defined level is listed, even without students
+            'students': payloads.students_by_level(
+                Student.objects.order_by('id'), levels=Student.Levels.values
+            ),
+            'records': records(Record.objects.all()),
+        }
+
+    @staticmethod
+    def level_page_data(cursor, level, after, limit, records=payloads.records_map):
+        # Keyset pagination by student id; fetch one extra row to know if another page exists
+        students = payloads.students_by_level(
+            Student.objects.filter(level=level, id__gt=after).order_by('id')[:limit + 1], levels=[level]
+        )
+        has_more = len(students[level]) > limit
+        del students[level][limit:]
+        recs = Record.objects.filter(student__level=level, student_id__gt=after)
+        if has_more:
+            recs = recs.filter(student_id__lte=students[level][-1]['id'])
+
+        return {
+            'cursor': cursor,
+            'delta': False,
+            'lessons': payloads.lessons(Lesson.objects.all()),
+            'students': students,
+            'records': records(recs),
+            'next': students[level][-1]['id'] if has_more else None,
+        }
+
+    async def get_delta(self, cursor, since, level=None, records=payloads.records_map):
+        body = await self.encoded(self.delta_data, cursor, since, level, records)
+        return HttpResponse(body, content_type='application/json')
+
+    @staticmethod
+    @sync_to_async
+    def encoded(build, *args):
+        # The builders stream values_list() rows into the payload and encoding
+        # it is pure CPU: both run on the request's sync thread, in one hop
+        # instead of one per query, and the event loop keeps serving
+        return payloads.encode(build(*args))
+
+    @staticmethod
+    def delta_data(cursor, since, level=None, records=payloads.records_map):
+        students = Student.objects.filter(version__gt=since).order_by('id')
+        recs = Record.objects.filter(version__gt=since)
+        tombstones = Tombstone.objects.filter(version__gt=since).order_by('version', 'id')
+        if level is not None:
+            students = students.filter(level=level)
+            recs = recs.filter(student__level=level)
+            tombstones = tombstones.filter(Q(level=level) | Q(kind=Tombstone.Kinds.LESSON))
+
+        return {
+            'cursor': cursor,
+            'delta': True,
+            'lessons': payloads.lessons(Lesson.objects.filter(version__gt=since)),
+            'students': payloads.students_by_level(students),
+            'records': records(recs),
+            'deleted': payloads.deleted(tombstones),
         }
-        return Response(DashboardStateSerializer(data).data)
+
+
+def notify_change(version):
+    """Announce the write stamped ``version``; call inside its transaction.
+
+    Cached state of the levels it touched is invalidated right away. Once it
+    commits, each of those levels with an open event stream gets what
+    ``?level=<level>&since=<version - 1>`` would return, plus ``since``; after
+    a clear-all every stream gets ``reset`` instead.
+    """
+    touched = state_cache.record_change(version)
+
+    def send():
+        broker = events.get_broker()
+        levels = broker.channels()
+        if state_cache.ALL_LEVELS not in touched:
+            levels &= touched
+        if not levels:
+            return
+        since = version - 1
+        state = ChangeCursor.load()
+        for level in levels:
+            if since < state.reset_at:
+                data = {'cursor': state.value, 'reset': True}
+            else:
+                data = DashboardStateView.delta_data(state.value, since, level)
+            broker.publish(level, payloads.encode({**data, 'since': since}).decode())
+    transaction.on_commit(send, robust=True)
+
+
+class DashboardEventsView(View):
+    """Server-sent change events for one level (``?level=B1``).
+
+    Streams are only served under ASGI; a WSGI worker would be held for as long
+    as the page is open, so there the view answers 204 and the dashboard keeps
+    syncing after its own writes.
+    """
+    KEEPALIVE_SECONDS = 20
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"error": "not_authenticated"}, status=403)
+        level = request.GET.get('level')
+        levels = [c[0] for c in Student.Levels.choices]
+        if level not in levels:
+            return JsonResponse({"error": "invalid_level", "levels": levels}, status=400)
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+        resp = StreamingHttpResponse(self.stream(level), content_type='text/event-stream')
+        resp['Cache-Control'] = 'no-cache'
+        # Don't let a proxy buffer the stream
+        resp['X-Accel-Buffering'] = 'no'
+        return resp
+
+    async def stream(self, level):
+        sub = events.get_broker().subscribe(level)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(sub.get(), self.KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'data: {message}\n\n'
+        finally:
+            sub.close()
 
 
 class DashboardSaveView(APIView):
@@ -114,67 +307,47 @@ class DashboardSaveView(APIView):
         #   students: [ {id,name,note} ],
         #   lessons: [ {id,date} ]
         # }
-        records = payload.get('records', {})
-        # Upsert records: only create/update when there is meaningful data.
-        # If payload for a student/lesson is completely empty, delete any existing record instead of creating a default 'A'.
-        for sid, lessons in records.items():
-            for lid, r in lessons.items():
-                data = dict(r)
-                # Normalize attendance but allow empty string for detection
-                att = data.get('attendance', '')
-                if isinstance(att, bool):
-                    att = 'P' if att else ''
-                if att not in ('P', 'E', 'A'):
-                    att = ''
-                hw = bool(data.get('homework'))
-                extra = (data.get('extra') or '').strip()
-                try:
-                    test_score = int(data.get('test_score') or 0)
-                except Exception:
-                    test_score = 0
+        # Cells with no meaningful data delete any existing record instead of creating a default 'A'.
+        # Everything is validated up front and written with a handful of bulk queries.
+        # Any item may carry the `version` it was loaded with; items changed by someone
+        # else since then are returned in `conflicts` and not applied.
+        try:
+            result = save_grid(
+                payload.get('records', {}),
+                payload.get('students', []),
+                payload.get('lessons', []),
+            )
+        except InvalidPayload as exc:
+            return Response({"error": "invalid_payload", "errors": exc.errors}, status=400)
+        if result['version'] is not None:
+            notify_change(result['version'])
+        return Response({"status": "ok", "conflicts": result['conflicts']})
 
-                has_data = (att in ('P', 'E', 'A')) or hw or (extra != '') or (test_score > 0)
 
-                if not has_data:
-                    # remove existing record if present; don't create a new empty record
-                    Record.objects.filter(student_id=sid, lesson_id=lid).delete()
-                    continue
-
-                # If we have other data but attendance is empty, default to 'A' (absent)
-                if att == '':
-                    att = 'A'
-
-                data['attendance'] = att
-                data['homework'] = hw
-                data['extra'] = extra
-                data['test_score'] = test_score
-
-                obj, _ = Record.objects.get_or_create(student_id=sid, lesson_id=lid)
-                ser = RecordSerializer(instance=obj, data=data, partial=True)
-                ser.is_valid(raise_exception=True)
-                ser.save()
-
-        # Update students basic info if provided
-        students_update = payload.get('students', [])
-        for s in students_update:
-            if 'id' in s:
-                Student.objects.filter(id=s['id']).update(name=s.get('name', ''), note=s.get('note', ''))
-
-        # Update lessons (dates)
-        lessons_update = payload.get('lessons', [])
-        for l in lessons_update:
-            if 'id' in l:
-                # allow blank/null date; parse ISO date string
-                d = l.get('date')
-                dt = None
-                try:
-                    if d:
-                        dt = date.fromisoformat(d)
-                except Exception:
-                    dt = None
-                Lesson.objects.filter(id=l['id']).update(date=dt)
+class DashboardCellsView(APIView):
+    """Save only edited cells; the full-grid DashboardSaveView stays as a fallback."""
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminOrTeacher]
 
-        return Response({"status": "ok"})
+    @transaction.atomic
+    def patch(self, request):
+        # Expected payload: { changes: [ [student_id, lesson_id, field, value, version?], ... ] }
+        #   field: attendance|homework|extra|test_score (one cell, merged over the stored record),
+        #          name|note (lesson_id null) or date (student_id null)
+        #   version: row version the edit is based on (0 for an empty cell); stale edits come
+        #            back in `conflicts` with the current server value instead of being applied
+        # Applied rows now carry `version` (null when nothing was written); cells listed in
+        # `emptied` have no record any more.
+        changes = request.data.get('changes', [])
+        if not isinstance(changes, list):
+            return Response({"error": "invalid_payload"}, status=400)
+        try:
+            result = apply_changes(changes)
+        except InvalidPayload as exc:
+            return Response({"error": "invalid_payload", "errors": exc.errors}, status=400)
+        if result['version'] is not None:
+            notify_change(result['version'])
+        return Response({"status": "ok", **result})
 
 
 class DashboardClearView(APIView):
@@ -182,11 +355,14 @@ class DashboardClearView(APIView):
     # Only admins may clear all records
     permission_classes = [IsAuthenticated, IsAdminOnly]
 
-    @transaction.atomic
     def post(self, request):
-        Record.objects.all().delete()
-        # Also clear student names and notes as requested
-        Student.objects.all().update(name="", note="")
+        # Deletes every record and clears student names and notes, in chunked
+        # transactions (see deletions.py). With CLEAR_SNAPSHOTS the removed data
+        # is archived first; `manage.py restore_snapshot <file>` brings it back.
+        snapshot_root = settings.SNAPSHOT_ROOT if settings.CLEAR_SNAPSHOTS else None
+        _, snapshot = deletions.clear_all(on_change=notify_change, snapshot_root=snapshot_root)
+        if snapshot:
+            return Response({"status": "cleared_all", "snapshot": snapshot.name})
         return Response({"status": "cleared_all"})
 
 
@@ -194,9 +370,12 @@ class LessonAddView(APIView):
     authentication_classes = [SessionAuthentication]
     permission_classes = [IsAuthenticated, IsAdminOrTeacher]
 
+    @transaction.atomic
     def post(self, request):
+        version = ChangeCursor.advance()
         count = Lesson.objects.count()
-        lesson = Lesson.objects.create(title=f"{count+1}-dars", order=count, date=date.today())
+        lesson = Lesson.objects.create(title=f"{count+1}-dars", order=count, date=date.today(), version=version)
+        notify_change(version)
         return Response(LessonSerializer(lesson).data)
 
 
@@ -214,8 +393,9 @@ class LessonRemoveView(APIView):
         last = Lesson.objects.order_by('-order', '-id').first()
         if not last:
             return Response({"status": "noop"})
-        Record.objects.filter(lesson=last).delete()
-        last.delete()
+        version = ChangeCursor.advance()
+        deletions.remove_lesson(last, version)
+        notify_change(version)
         return Response({"status": "removed"})
 
 
@@ -223,12 +403,14 @@ class StudentAddView(APIView):
     authentication_classes = [SessionAuthentication]
     permission_classes = [IsAuthenticated, IsAdminOrTeacher]
 
+    @transaction.atomic
     def post(self, request):
         level = request.data.get('level')
         levels = [c[0] for c in Student.Levels.choices]
         if level not in levels:
             return Response({"error": "invalid_level", "levels": levels}, status=400)
-        s = Student.objects.create(level=level, name="")
+        s = Student.objects.create(level=level, name="", version=ChangeCursor.advance())
+        notify_change(s.version)
         return Response(StudentSerializer(s).data)
 
 
@@ -237,6 +419,7 @@ class StudentRemoveView(APIView):
     # Only admins may remove student rows
     permission_classes = [IsAuthenticated, IsAdminOnly]
 
+    @transaction.atomic
     def post(self, request):
         level = request.data.get('level')
         levels = [c[0] for c in Student.Levels.choices]
@@ -250,106 +433,143 @@ class StudentRemoveView(APIView):
         if qs.count() <= 30:
             return Response({"status": "min_reached", "min": 30})
         stu = qs.first()
-        stu.delete()
+        version = ChangeCursor.advance()
+        deletions.remove_student(stu, version)
+        notify_change(version)
         return Response({"status": "removed"})
 
 
-class DashboardExportView(APIView):
+class DashboardStatsView(View):
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"error": "not_authenticated"}, status=403)
+        # ?student=<id> for one student, ?level=B1 for a level, neither for the whole school
+        student_id = request.GET.get('student')
+        if student_id is not None:
+            try:
+                student = await Student.objects.filter(id=int(student_id)).afirst()
+            except ValueError:
+                return JsonResponse({"error": "invalid_student"}, status=400)
+            if student is None:
+                return JsonResponse({"error": "not_found"}, status=404)
+            return JsonResponse({"scope": "student", "student": student.id, **await stats.astudent_stats(student)})
+
+        level = request.GET.get('level')
+        if level is None:
+            return JsonResponse({"scope": "school", **await stats.agroup_stats()})
+        levels = [c[0] for c in Student.Levels.choices]
+        if level not in levels:
+            return JsonResponse({"error": "invalid_level", "levels": levels}, status=400)
+        return JsonResponse({"scope": "level", "level": level, **await stats.agroup_stats(level)})
+
+
+class DashboardCacheView(APIView):
     authentication_classes = [SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsAdminOnly]
 
     def get(self, request):
-        # Build an Excel (xlsx) file in-memory; fallback to CSV if openpyxl missing.
-        lessons = list(Lesson.objects.all())
-        students = list(Student.objects.all().order_by('level', 'id'))
-        recs = Record.objects.select_related('student', 'lesson').all()
-        records_map = {}
-        for r in recs:
-            records_map.setdefault(r.student_id, {})[r.lesson_id] = r
-
-        # Determine which lessons have any meaningful data across all students
-        def has_data(r: Record):
-            if not r:
-                return False
-            if r.attendance in ('P', 'E'):
-                return True
-            if r.homework:
-                return True
-            if (r.extra or '').strip():
-                return True
-            if (r.test_score or 0) > 0:
-                return True
-            return False
+        # Hit/miss counters of the state cache (per process with the default LocMem backend)
+        return Response(state_cache.stats())
 
-        lessons_with_data = []
-        for l in lessons:
-            any_data = any(has_data(records_map.get(s.id, {}).get(l.id)) for s in students)
-            if any_data:
-                lessons_with_data.append(l)
+    def delete(self, request):
+        state_cache.reset_stats()
+        return Response(status=204)
 
-        # Optionally filter out students that have no data at all
-        students_with_data = []
-        for s in students:
-            any_data = any(has_data(records_map.get(s.id, {}).get(l.id)) for l in lessons_with_data)
-            if any_data:
-                students_with_data.append(s)
 
+class DashboardExportView(View):
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"error": "not_authenticated"}, status=403)
+        # Excel (xlsx) by default, CSV with ?type=csv or when openpyxl is missing.
+        # A file already built for the current data (see ExportJobView) is
+        # served from disk; otherwise the export is built row by row from
+        # server-side cursors (see exports.py) into a temporary file on the
+        # export pool, while this worker goes on serving other requests, and
+        # sent from there once its read transaction has ended.
+        fmt = export_format(request)
+        fileobj = await sync_to_async(exports.cached_artifact)(fmt) or await exports.aexport_tempfile(fmt)
+        return file_response(request, fileobj, f'dashboard.{fmt}', exports.CONTENT_TYPES[fmt])
+
+
+class DashboardImportView(APIView):
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminOrTeacher]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        # Multipart upload `file`: a sheet in the export's layout (see imports.py).
+        # xlsx by file extension or ?type=xlsx, CSV otherwise. Written in chunks,
+        # each in its own transaction; rows that fail validation are skipped and
+        # listed in `errors` (row numbers count the header as row 1).
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "missing_file"}, status=400)
+        fmt = request.query_params.get('type') or (
+            ExportJob.Formats.XLSX if upload.name.lower().endswith('.xlsx') else ExportJob.Formats.CSV
+        )
+        if fmt not in imports.READERS:
+            return Response({"error": "invalid_format", "formats": list(imports.READERS)}, status=400)
+        if fmt == ExportJob.Formats.XLSX and not exports.xlsx_available():
+            return Response({"error": "xlsx_unavailable"}, status=400)
         try:
-            from openpyxl import Workbook
-            from openpyxl.utils import get_column_letter
-            wb = Workbook()
-            ws = wb.active
-            ws.title = 'Dashboard'
-
-            # Headers
-            headers = ['#', 'Ism Familiya', 'Daraja', 'Qo\'shimcha izoh']
-            for idx, h in enumerate(headers, start=1):
-                ws.cell(row=1, column=idx, value=h)
-            col = len(headers) + 1
-            for l in lessons_with_data:
-                ws.cell(row=1, column=col, value=f"{l.title}")
-                col += 1
-
-            # Rows
-            row_idx = 2
-            for i, s in enumerate(students_with_data, start=1):
-                ws.cell(row=row_idx, column=1, value=i)
-                ws.cell(row=row_idx, column=2, value=s.name)
-                ws.cell(row=row_idx, column=3, value=s.level)
-                ws.cell(row=row_idx, column=4, value=s.note)
-                col = 5
-                for l in lessons_with_data:
-                    rec = records_map.get(s.id, {}).get(l.id)
-                    att = rec.attendance if rec else ''
-                    symbol = {'P': '+', 'E': '−', 'A': ''}.get(att, '')  # hide plain '×' to avoid clutter
-                    ws.cell(row=row_idx, column=col, value=symbol)
-                    col += 1
-                row_idx += 1
-
-            from io import BytesIO
-            buf = BytesIO()
-            wb.save(buf)
-            buf.seek(0)
-            resp = HttpResponse(
-                buf.read(),
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            resp['Content-Disposition'] = 'attachment; filename="dashboard.xlsx"'
-            return resp
-        except Exception:
-            # Fallback to CSV
-            import csv
-            from io import StringIO
-            sio = StringIO()
-            writer = csv.writer(sio)
-            writer.writerow(['#', 'Ism Familiya', 'Daraja', 'Izoh'] + [l.title for l in lessons_with_data])
-            for i, s in enumerate(students_with_data, start=1):
-                row = [i, s.name, s.level, s.note]
-                for l in lessons_with_data:
-                    rec = records_map.get(s.id, {}).get(l.id)
-                    att = rec.attendance if rec else ''
-                    row.append({'P': '+', 'E': '−', 'A': ''}.get(att, ''))
-                writer.writerow(row)
-            resp = HttpResponse(sio.getvalue(), content_type='text/csv')
-            resp['Content-Disposition'] = 'attachment; filename="dashboard.csv"'
-            return resp
+            result = imports.import_rows(imports.READERS[fmt](upload.file), on_change=notify_change)
+        except imports.InvalidSheet as exc:
+            return Response({"error": "invalid_sheet", "detail": str(exc)}, status=400)
+        return Response({"status": "ok", **result.as_dict()})
+
+
+def export_format(request):
+    if request.GET.get('type') == 'csv' or not exports.xlsx_available():
+        return ExportJob.Formats.CSV
+    return ExportJob.Formats.XLSX
+
+
+def file_response(request, fileobj, filename, content_type):
+    resp = FileResponse(fileobj, as_attachment=True, filename=filename, content_type=content_type)
+    if isinstance(request, ASGIRequest):
+        # Django reads a sync file iterator to the end before an ASGI response starts
+        resp.streaming_content = exports.aiter_file(fileobj)
+    return resp
+
+
+class ExportJobCreateView(APIView):
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Queue an export of the current data (?type=csv as for DashboardExportView).
+        # Returns the job; poll it until status is done, then follow `download`.
+        with transaction.atomic():
+            job = exports.start_job(export_format(request), user=request.user)
+        return Response(ExportJobSerializer(job).data, status=202)
+
+
+class ExportJobView(APIView):
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = ExportJob.objects.filter(pk=pk).first()
+        if job is None:
+            return Response({"error": "not_found"}, status=404)
+        return Response(ExportJobSerializer(job).data)
+
+
+class ExportJobDownloadView(APIView):
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = ExportJob.objects.filter(pk=pk, status=ExportJob.Statuses.DONE).first()
+        if job is None:
+            return Response({"error": "not_ready"}, status=404)
+        try:
+            fileobj = open(exports.artifact_path(job.key, job.format), 'rb')
+        except FileNotFoundError:
+            # Superseded by an export of newer data; start a new job
+            return Response({"error": "export_expired"}, status=410)
+        return file_response(
+            request._request, fileobj, f'dashboard.{job.format}', exports.CONTENT_TYPES[job.format]
+        )
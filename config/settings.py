@@ -46,9 +46,14 @@ INSTALLED_APPS = [
     'accounts',
 ]
 
+# Middlewares above a sync-only one run in sync mode too. WhiteNoise is
+# sync-only, so it goes first (as its docs recommend) and the ones below it
+# stay async under ASGI
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'accounts.instrumentation.InstrumentationMiddleware',
+    'accounts.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,16 +85,50 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': env('DB_NAME'),
-        'USER': env('DB_USER'),
-        'PASSWORD': env('DB_PASSWORD'),
-        'HOST': env('DB_HOST', default='localhost'),
-        'PORT': env('DB_PORT', default='5432'),
+if env('DATABASE_URL', default=''):
+    # Any database by URL, e.g. sqlite:////tmp/bench.sqlite3 for local benchmarks
+    DATABASES = {'default': env.db('DATABASE_URL')}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env('DB_NAME'),
+            'USER': env('DB_USER'),
+            'PASSWORD': env('DB_PASSWORD'),
+            'HOST': env('DB_HOST', default='localhost'),
+            'PORT': env('DB_PORT', default='5432'),
+        }
     }
-}
+
+# Connection reuse on PostgreSQL. By default a connection stays open for
+# DB_CONN_MAX_AGE seconds and serves the following requests of its thread.
+# With DB_POOL each server process keeps a psycopg pool instead (needs
+# psycopg-pool); by default it gets an equal share of DB_MAX_CONNECTIONS, split
+# over the WEB_CONCURRENCY gunicorn workers (see supervisor/gunicorn.py). Either
+# way a reused connection is checked before use (DB_CONN_HEALTH_CHECKS).
+# Under ASGI (SERVER_MODE=asgi) each request does its database work on a thread
+# of its own, so connections are only reused through the pool.
+WEB_CONCURRENCY = env.int('WEB_CONCURRENCY', default=3)
+SERVER_MODE = env('SERVER_MODE', default='wsgi')
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = env.bool('DB_CONN_HEALTH_CHECKS', default=True)
+    if env.bool('DB_POOL', default=False):
+        # Pooled connections are returned after each request, never kept
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=1),
+            'max_size': env.int(
+                'DB_POOL_MAX_SIZE', default=max(2, env.int('DB_MAX_CONNECTIONS', default=20) // WEB_CONCURRENCY)
+            ),
+            # Seconds a request waits for a free connection before failing
+            'timeout': env.float('DB_POOL_TIMEOUT', default=10.0),
+            # Idle connections above min_size are closed after this many seconds
+            'max_idle': env.float('DB_POOL_MAX_IDLE', default=600.0),
+        }
+    elif SERVER_MODE == 'asgi':
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=60)
 
 
 # Password validation
@@ -131,6 +170,50 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# LocMem (per worker) unless CACHE_URL names a shared backend, e.g.
+# filecache:///var/tmp/dashboard or dbcache://cache_table (run createcachetable)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+# Seconds an encoded /dashboard/state/ snapshot is kept (see accounts/state_cache.py)
+STATE_CACHE_TIMEOUT = env.int('STATE_CACHE_TIMEOUT', default=600)
+
+# Finished dashboard exports, cached per data version (see accounts/exports.py)
+EXPORT_ROOT = Path(env('EXPORT_ROOT', default=str(BASE_DIR / 'exports')))
+# Background threads per server process that build exports
+EXPORT_WORKERS = env.int('EXPORT_WORKERS', default=2)
+
+# Archive what "clear all" removes under SNAPSHOT_ROOT (see accounts/deletions.py)
+CLEAR_SNAPSHOTS = env.bool('CLEAR_SNAPSHOTS', default=False)
+SNAPSHOT_ROOT = Path(env('SNAPSHOT_ROOT', default=str(BASE_DIR / 'snapshots')))
+
+# Fan-out for /dashboard/events/ (see accounts/events.py); the local broker
+# only reaches streams served by the same process, accounts.events.PostgresBroker
+# every process using the same database
+EVENTS_BROKER = env('EVENTS_BROKER', default='accounts.events.LocalBroker')
+
+# Dynamic responses compressed by accounts.compression.CompressionMiddleware
+# (gzip; brotli/zstd with the optional Brotli/zstandard packages)
+COMPRESS_CONTENT_TYPES = ('application/json', 'text/csv')
+# Smaller non-streaming bodies are sent as they are
+COMPRESS_MIN_SIZE = env.int('COMPRESS_MIN_SIZE', default=1024)
+
+# accounts.instrumentation.InstrumentationMiddleware logs every request with
+# its query count and DB time at INFO (LOG_LEVEL=INFO to see them), and
+# statements slower than this many milliseconds as warnings
+SLOW_QUERY_MS = env.float('SLOW_QUERY_MS', default=100)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'accounts': {'handlers': ['console'], 'level': env('LOG_LEVEL', default='WARNING')},
+    },
+}
+
 
 SECURE_CROSS_ORIGIN_OPENER_POLICY = None
 
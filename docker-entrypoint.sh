@@ -0,0 +1,9 @@
+#!/bin/sh
+# Bring the database up to date before the server starts. seed_dashboard only
+# writes on a fresh database, so re-running it on every start is free.
+set -e
+
+python manage.py migrate --noinput
+python manage.py seed_dashboard
+
+exec "$@"
@@ -1,3 +1,24 @@
 
-bind = '0.0.0.0:8000'
-workers = 3
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+# Also read by config/settings.py to size each worker's database pool (DB_POOL)
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+
+# SERVER_MODE=asgi serves config/asgi.py from uvicorn workers (uvicorn-worker):
+# one worker then handles many requests at once, and async views only hold a
+# thread while they wait on the database. The default is the WSGI application
+# on sync workers, one request per worker at a time.
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # The default events broker only reaches streams in its own process, so
+    # live updates need a single worker unless EVENTS_BROKER relays between
+    # processes (accounts.events.PostgresBroker, see accounts/events.py)
+    if os.environ.get('EVENTS_BROKER', 'accounts.events.LocalBroker') == 'accounts.events.LocalBroker':
+        workers = 1
+elif SERVER_MODE == 'wsgi':
+    wsgi_app = 'config.wsgi:application'
+else:
+    raise ValueError(f"SERVER_MODE must be 'wsgi' or 'asgi', not {SERVER_MODE!r}")